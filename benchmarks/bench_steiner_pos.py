@@ -0,0 +1,83 @@
+'''
+Compare model building and solving for the loop and vectorized
+formulations of junction_loc.steiner_pos, and for the shared template
+(already used for another tree of the same shape).
+
+usage: python benchmarks/bench_steiner_pos.py [nterms ...]
+'''
+
+import random
+import sys
+import time
+
+import cvxpy as cvx
+
+from geonet.flow import find_tree_flow, make_forward_flow
+from geonet.isomorph import count_fsts, iter_enum_orderly
+import geonet.junction_loc as jl
+
+diams = [0.4, 0.6, 0.8, 1., 1.2]
+costs = [680., 910., 1200., 1550., 1960.]
+pres_bds = [40, 80]
+
+
+def random_instance(nterms, seed=0):
+    '''random terminals with a single source, and some FST topology'''
+    rand = random.Random(seed + nterms)
+    term_pos = {'t%03d' % i: (rand.uniform(0, 100), rand.uniform(0, 100))
+                for i in range(nterms)}
+    terms = sorted(term_pos)
+    demand = {t: 1.0 for t in terms[1:]}
+    demand[terms[0]] = -float(nterms - 1)
+
+    index = rand.randrange(count_fsts(nterms))
+    _, tree = next(iter_enum_orderly(term_pos, start=index))
+    flow = find_tree_flow(tree, demand)
+    return make_forward_flow(tree, flow)
+
+
+def measure(build, tree, flow):
+    start = time.time()
+    prob, _ = build(tree, flow, diams, costs, pres_bds, 1.0)
+    built = time.time()
+    prob.get_problem_data(cvx.CVXOPT)
+    canonicalized = time.time()
+    try:
+        prob.solve(solver=cvx.CVXOPT)
+        obj = prob.value
+    except cvx.SolverError:
+        obj = None
+    solved = time.time()
+    return built - start, canonicalized - built, solved - canonicalized, obj
+
+
+def measure_template(tree, flow, other_tree, other_flow):
+    shape = (len(tree.get_nodes()), len(tree.get_arcs()),
+             len(tree.get_terminal_nodes()), len(diams))
+    template = jl.get_template(*shape)
+    template.solve(other_tree, other_flow, diams, costs, pres_bds)
+    start = time.time()
+    _, obj = template.solve(tree, flow, diams, costs, pres_bds)
+    return 0.0, 0.0, time.time() - start, obj
+
+
+def main(sizes):
+    header = '%6s %6s %-10s %8s %8s %8s %14s'
+    row = '%6d %6d %-10s %8.3f %8.3f %8.3f %14s'
+    print header % ('terms', 'arcs', 'model', 'build', 'canon', 'solve', 'objective')
+    for nterms in sizes:
+        tree, flow = random_instance(nterms)
+        for name, build in [('loops', jl._build_loops),
+                            ('vectorized', jl._build_vectorized)]:
+            b, c, s, obj = measure(build, tree, flow)
+            obj = 'failed' if obj is None else '%.2f' % obj
+            print row % (nterms, len(tree.get_arcs()), name, b, c, s, obj)
+        other_tree, other_flow = random_instance(nterms, seed=1)
+        b, c, s, obj = measure_template(tree, flow, other_tree, other_flow)
+        obj = 'failed' if obj is None else '%.2f' % obj
+        print row % (nterms, len(tree.get_arcs()), 'template', b, c, s, obj)
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]] or [10, 25, 50]
+    main(sizes)
@@ -2,52 +2,172 @@
 Find crossing edges in solutions.
 '''
 
+from collections import defaultdict
 from itertools import combinations
 
 import numpy as np
-import numpy.linalg as la
 
 from geonet.network import SteinerTree, merge_pos
-from geonet.geometry import distance
+from geonet.geometry import position_array, arc_index_array, arc_lengths
 from geonet.constants import abstol
 
 
-def crossing_edges(tree, steiner_pos, abstol=abstol):
-    '''Find crossing edges
+def _cross(u, v):
+    '''z-component of cross product of stacked 2d vectors'''
+    return u[..., 0]*v[..., 1] - u[..., 1]*v[..., 0]
+
+
+def segment_crossings(segs, pairs, ends=None, abstol=abstol):
+    '''Test pairs of segments for crossings, all at once
+
+    Skips adjacent segments (sharing an end node), degenerate segments
+    (shorter than abstol) and parallel segments (singular 2x2 system,
+    with the same threshold as numpy.linalg.matrix_rank). The crossing
+    point should not be too near one of the segments' end points
+    (relative to abstol and the segments' lengths).
 
-    Compare all pairs of edges. The crossing point should not be too
-    near one of the edges' end nodes (w.r.t. abstol).
+    args:
+    - segs: (m, 2, 2) array of end point coordinates
+    - pairs: (k, 2) array of segment indices to compare
+    - ends: (m, 2) array of end node indices, to detect adjacency
+    - abstol: absolute tolerance for degenerate edges and crossings
+
+    returns boolean mask of crossing pairs
     '''
+    pairs = np.asarray(pairs, dtype=int).reshape(-1, 2)
+    I, J = pairs[:, 0], pairs[:, 1]
+    a, b = segs[I, 0], segs[I, 1]
+    c, d = segs[J, 0], segs[J, 1]
+
+    # linear system for intersection of the spanned lines:
+    # [p q] x = r
+    p, q, r = b - a, c - d, c - a
+    # lengths of the compared segments only (rows 2i, 2i+1 are the ends)
+    points = segs.reshape(-1, 2)
+    d_ab = arc_lengths(points, np.column_stack([2*I, 2*I + 1]))
+    d_cd = arc_lengths(points, np.column_stack([2*J, 2*J + 1]))
+    det = _cross(p, q)
+
+    # singular values: smax**2 + smin**2 = pp + qq, smax * smin = |det|
+    pp, qq = d_ab**2, d_cd**2
+    smax2 = 0.5*(pp + qq + np.sqrt((pp - qq)**2 + 4*(p*q).sum(axis=1)**2))
+    parallel = np.abs(det) <= 2*np.finfo(float).eps*smax2
+
+    mask = ~parallel & (d_ab >= abstol) & (d_cd >= abstol)
+    if ends is not None:
+        ends = np.asarray(ends)
+        e, f = ends[I], ends[J]
+        adjacent = ((e[:, :, None] == f[:, None, :])).any(axis=(1, 2))
+        mask &= ~adjacent
 
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x0 = _cross(r, q) / det
+        x1 = _cross(p, r) / det
+        reltol = abstol * 2.0 / (d_ab + d_cd)
+        mask &= (x0 >= reltol) & (x0 <= 1 - reltol)
+        mask &= (x1 >= reltol) & (x1 <= 1 - reltol)
+    return mask
+
+
+def _grid_candidates(segs, max_cells=16):
+    '''Pairs of segments with bounding boxes in a common grid cell
+
+    The cell size is the median extent of the segments, but at least
+    such that there are no more cells than segments along an axis.
+    Segments whose bounding box covers more than max_cells cells (long
+    ones, among many short ones) are not put into the grid, but paired
+    with all other segments.
+
+    args:
+    - segs: (m, 2, 2) array of end point coordinates
+    - max_cells: maximum number of grid cells per segment
+
+    returns (k, 2) array of index pairs (i, j) with i < j, sorted
+    '''
+    m = len(segs)
+    lo = segs.min(axis=1)
+    hi = segs.max(axis=1)
+    span = (hi.max(axis=0) - lo.min(axis=0)).max()
+    cell = max(np.median((hi - lo).max(axis=1)), span / m)
+    if cell <= 0.0:
+        return _all_pairs(m)
+
+    origin = lo.min(axis=0)
+    ilo = np.floor((lo - origin) / cell).astype(int)
+    ihi = np.floor((hi - origin) / cell).astype(int)
+    ncells = (ihi - ilo + 1).prod(axis=1)
+    large = ncells > max_cells
+
+    buckets = defaultdict(list)
+    for i in np.flatnonzero(~large):
+        for gx in range(ilo[i, 0], ihi[i, 0] + 1):
+            for gy in range(ilo[i, 1], ihi[i, 1] + 1):
+                buckets[gx, gy].append(i)
+
+    pairs = set()
+    for members in buckets.values():
+        pairs.update(combinations(members, 2))
+    for i in np.flatnonzero(large):
+        pairs.update((min(i, j), max(i, j)) for j in range(m) if j != i)
+    return np.array(sorted(pairs), dtype=int).reshape(-1, 2)
+
+
+def _all_pairs(m):
+    '''(k, 2) array of all index pairs (i, j) with i < j, sorted'''
+    return np.transpose(np.triu_indices(m, 1))
+
+
+def _segments(tree, steiner_pos):
+    '''arcs, (m, 2, 2) segment array and (m, 2) end node indices'''
     assert isinstance(tree, SteinerTree)
     pos = merge_pos(tree, steiner_pos)
+    nodes, arcs = tree.get_nodes(), tree.get_arcs()
+    ends = arc_index_array(nodes, arcs)
+    segs = position_array(nodes, pos)[ends]
+    return arcs, segs, ends
 
-    result = []
 
-    for pair in combinations(tree.get_arcs(), 2):
-        (a, b), (c, d) = pair
-        if a == c or a == d or b == c or b == d:
-            continue # skip adjacent edges
+def _candidates(segs, method):
+    if method == 'grid':
+        return _grid_candidates(segs) if len(segs) > 1 else _all_pairs(0)
+    elif method == 'pairs':
+        return _all_pairs(len(segs))
+    else:
+        raise ValueError('Unknown method: %s' % method)
 
-        d_ab, d_cd = distance(pos[a], pos[b]), distance(pos[c], pos[d])
-        if d_ab < abstol or d_cd < abstol:
-            continue # skip degenerate edges
 
-        # solve linear system for intersection of two spanned lines
-        # L x = r
-        L = np.array([[pos[b][0] - pos[a][0], pos[c][0] - pos[d][0]],
-                      [pos[b][1] - pos[a][1], pos[c][1] - pos[d][1]]])
-        if la.matrix_rank(L) < 2:
-            continue # skip parallel lines
-        r = np.array([pos[c][0] - pos[a][0],
-                      pos[c][1] - pos[a][1]])
-        x = la.solve(L, r)
+def crossing_edges(tree, steiner_pos, abstol=abstol, method='grid'):
+    '''Find crossing edges
 
-        reltol = abstol * 2.0 / (d_ab + d_cd)
-        if x[0] < reltol or x[0] > 1 - reltol or \
-           x[1] < reltol or x[1] > 1 - reltol:
-            continue # intersection outside segments (or at boundary)
+    The crossing point should not be too near one of the edges' end
+    nodes (w.r.t. abstol).
 
-        result.append(pair)
+    args:
+    - tree: Steiner tree
+    - steiner_pos: positions of Steiner nodes
+    - abstol: absolute tolerance for degenerate edges and crossings
+    - method: 'grid' to compare only edges in common cells of a uniform
+              grid over the bounding boxes, or 'pairs' to compare all
+              pairs of edges
+
+    returns list of pairs of arcs, ordered as in tree.get_arcs()
+    '''
+    arcs, segs, ends = _segments(tree, steiner_pos)
+    pairs = _candidates(segs, method)
+    mask = segment_crossings(segs, pairs, ends, abstol)
+    return [(arcs[i], arcs[j]) for i, j in pairs[mask]]
 
-    return result
+
+def has_crossing(tree, steiner_pos, abstol=abstol, method='grid',
+                 chunksize=1024):
+    '''Check whether any edges cross, see crossing_edges
+
+    Candidate pairs are tested in chunks, stopping at the first crossing.
+    '''
+    arcs, segs, ends = _segments(tree, steiner_pos)
+    pairs = _candidates(segs, method)
+    for start in range(0, len(pairs), chunksize):
+        chunk = pairs[start:start + chunksize]
+        if segment_crossings(segs, chunk, ends, abstol).any():
+            return True
+    return False
@@ -2,63 +2,117 @@
 Detecting degeneracy and merging zero-length edges.
 '''
 
+import numpy as np
+from scipy.spatial import cKDTree
+
 from geonet.network import SteinerTree, merge_pos
-from geonet.geometry import distance
+from geonet.geometry import position_array, arc_index_array, arc_lengths
 from geonet.constants import abstol
 
-def degenerate_edges(tree, steiner_pos, abstol=abstol):
-    '''list of edges with (numerically) zero length'''
+
+def _node_arrays(tree, steiner_pos):
+    '''nodes, (n, 2) positions, (n,) steiner mask and (m, 2) arc indices'''
     assert isinstance(tree, SteinerTree)
     pos = merge_pos(tree, steiner_pos)
+    nodes = tree.get_nodes()
+    P = position_array(nodes, pos)
+    steiner = np.array([tree.is_steiner(n) for n in nodes], dtype=bool)
+    arcs = arc_index_array(nodes, tree.get_arcs())
+    return nodes, P, steiner, arcs
+
+
+def degenerate_edges(tree, steiner_pos, abstol=abstol):
+    '''list of edges with (numerically) zero length'''
+    nodes, P, steiner, arcs = _node_arrays(tree, steiner_pos)
+    lengths = arc_lengths(P, arcs)
+    mask = (steiner[arcs[:, 0]] | steiner[arcs[:, 1]]) & (lengths <= abstol)
+    return [(nodes[u], nodes[v]) for u, v in arcs[mask]]
 
-    return [(u,v) for (u,v) in tree.get_arcs()
-            if (tree.is_steiner(u) or tree.is_steiner(v))
-            and distance(pos[u], pos[v]) <= abstol]
+
+def coincident_nodes(tree, steiner_pos, abstol=abstol):
+    '''list of non-adjacent node pairs with (numerically) equal positions
+
+    Only pairs with at least one Steiner node are reported, the pairs of
+    a KD-tree query are ordered by node index.
+    '''
+    nodes, P, steiner, arcs = _node_arrays(tree, steiner_pos)
+    if len(nodes) < 2:
+        return []
+    pairs = cKDTree(P).query_pairs(abstol, output_type='ndarray')
+    pairs = np.sort(pairs, axis=1)
+    mask = steiner[pairs[:, 0]] | steiner[pairs[:, 1]]
+
+    adjacent = set(map(tuple, np.sort(arcs, axis=1)))
+    return sorted((nodes[u], nodes[v]) for u, v in pairs[mask]
+                  if (u, v) not in adjacent)
 
 
 def is_degenerate(tree, steiner_pos, abstol=abstol):
     return degenerate_edges(tree, steiner_pos, abstol) != []
 
 
-def merged(tree, steiner_pos, abstol=abstol):
+def _find(parent, i):
+    '''root of i in union-find forest, with path halving'''
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def merged(tree, steiner_pos, abstol=abstol, coincident=False):
     '''build new tree that merges all degenerate edges.
 
-    when merging an edge, the lexicographically smaller node will
-    survive. returns a tree and a matching dict of steiner node
-    positions.
+    Nodes are merged with a union-find over the degenerate edges, but no
+    two terminals are merged. A terminal survives its group, otherwise
+    the lexicographically smallest node. returns a tree and a matching
+    dict of steiner node positions.
+
+    With coincident=True, also non-adjacent nodes at the same position
+    are merged (see coincident_nodes). Arcs that become parallel or
+    antiparallel are kept only once, so nodes with a common neighbor
+    still give a tree. Nodes that are further apart close a cycle,
+    which is kept in the result.
     '''
-    degedges = degenerate_edges(tree, steiner_pos, abstol)
+    nodes = tree.get_nodes()
+    index = {n:i for i, n in enumerate(nodes)}
+    pairs = degenerate_edges(tree, steiner_pos, abstol)
+    if coincident:
+        pairs += coincident_nodes(tree, steiner_pos, abstol)
+
+    # union-find, remembering whether a group contains a terminal
+    parent = range(len(nodes))
+    terminal = [tree.is_terminal(n) for n in nodes]
+    for u, v in pairs:
+        ru, rv = _find(parent, index[u]), _find(parent, index[v])
+        if ru == rv or (terminal[ru] and terminal[rv]):
+            continue # don't merge terminals
+        if terminal[rv]:
+            ru, rv = rv, ru
+        parent[rv] = ru
 
     # key: removed node, value: remaining node (taking over)
+    survivor = {}
+    for i, n in enumerate(nodes):
+        r = _find(parent, i)
+        if terminal[r]:
+            survivor[r] = nodes[r]
+        elif r not in survivor or n < survivor[r]:
+            survivor[r] = n
     turn_into = {}
-    for u, v in degedges:
-        if tree.is_terminal(u) and tree.is_terminal(v):
-            # don't merge terminals
-            continue
-        elif tree.is_terminal(u):
-            # keep terminals
-            pass
-        elif tree.is_terminal(v):
-            # keep terminals
-            u, v = v, u
-        elif v < u:
-            # keep lexicographically smaller node
-            u, v = v, u
-
-        turn_into[v] = u
-
-    # merge nodes into transitive end-point
-    for v, u in turn_into.iteritems():
-        while u in turn_into:
-            u = turn_into[u]
-        turn_into[v] = u
+    for i, n in enumerate(nodes):
+        s = survivor[_find(parent, i)]
+        if s != n:
+            turn_into[n] = s
 
     # build new tree data
-    new_nodes = [u for u in tree.get_nodes() if u not in turn_into]
+    new_nodes = [u for u in nodes if u not in turn_into]
     new_edges = []
+    seen = set()
     for u, v in tree.get_arcs():
         uu, vv = turn_into.get(u, u), turn_into.get(v, v)
-        if uu != vv: # remove self-loops
+        if uu != vv and frozenset([uu, vv]) not in seen:
+            # remove self-loops and duplicate arcs
+            seen.add(frozenset([uu, vv]))
             new_edges.append((uu, vv))
     new_tree = SteinerTree(new_nodes, new_edges, tree.get_terminal_positions())
     new_pos = {s:steiner_pos[s] for s in steiner_pos if s in new_nodes}
@@ -1,14 +1,252 @@
 '''
 Diameter selection for fixed topology and node positions.
 
-Solved as linear program with cvxpy
+Solved as linear program with cvxpy (or scipy's linprog)
 '''
 
 import cvxpy as cvx
+import numpy as np
+import scipy as sp
+import scipy.optimize
 
-from geonet.flow import make_forward_flow
+from geonet.flow import make_forward_flow, arc_incidence
+from geonet.network import merge_pos
+from geonet.geometry import position_array, arc_index_array, arc_lengths
 
-def solve(tree, flow, steiner_pos, diams, costs, pres_bds, C=1.0, verbose=False):
+
+def _build_loops(N, A, L, flow, diams, costs, pres_bds, C):
+    '''LP with scalar variables per node and per (arc, diameter)
+
+    returns the problem and expressions for squared pressures and
+    relative lengths
+    '''
+    I = range(len(diams))
+    AI = [(a,i) for a in A for i in I]
+    scale = float(max(pres_bds))**2
+
+    # squared pressure at node (scaled by upper bound)
+    pp = {n:cvx.Variable(1) for n in N}
+
+    # relative length of pipe segment for differnet diameters
+    l = {(a, i):cvx.Variable(1) for (a, i) in AI}
+
+    conss = []
+
+    # pressure in bounds
+    for n in N:
+        conss += [pres_bds[0]**2 / scale <= pp[n], pp[n] <= 1.0]
+
+    # relative lengths are convex combinations
+    for a in A:
+        conss += [sum(l[a, i] for i in I) == 1.0]
+        conss += [0 <= l[a, i] for i in I]
+
+    # Weymouth equation on pipes
+    for k, a in enumerate(A):
+        u, v = a
+        cvx_comb = sum(diams[i]**(-5) * l[a, i] for i in I)
+        conss += [pp[u] - pp[v] == C * L[k] * flow[a]**2 / scale * cvx_comb]
+
+    # minimize total pipe cost
+    obj = sum(L[k] * costs[i] * l[a,i] for k, a in enumerate(A) for i in I)
+
+    prob = cvx.Problem(cvx.Minimize(obj), conss)
+    return prob, [scale * pp[n] for n in N], [[l[a, i] for i in I] for a in A]
+
+
+def _build_vectorized(N, A, L, flow, diams, costs, pres_bds, C):
+    '''LP with a vector of pressures and a matrix of relative lengths
+
+    The constraints use the sparse incidence matrix, so the model size
+    is linear in the number of arcs and diameters. Squared pressures
+    are scaled by the upper bound, for better numerical conditioning.
+    '''
+    B = arc_incidence(N, A, sparse=True)
+    dinv = np.array(diams, dtype=float)**-5
+    coef = C * L * np.array([flow[a] for a in A])**2
+    scale = float(max(pres_bds))**2
+
+    pp = cvx.Variable(len(N))
+    l = cvx.Variable(len(A), len(diams))
+
+    conss = [pp >= min(pres_bds)**2 / scale, pp <= 1.0,
+             l >= 0, l * np.ones(len(diams)) == 1.0,
+             B * pp == cvx.mul_elemwise(coef / scale, l * dinv)]
+    obj = cvx.sum_entries(cvx.mul_elemwise(np.outer(L, costs), l))
+
+    prob = cvx.Problem(cvx.Minimize(obj), conss)
+    return prob, scale * pp, l
+
+
+def _lp_data(N, A, L, diams, costs):
+    '''structure of the LP shared by all flows and pressure bounds
+
+    returns sparse incidence matrix, sparse rows of the convex
+    combinations, inverse diameter powers and costs of relative lengths
+    '''
+    m, k = len(A), len(diams)
+    B = arc_incidence(N, A, sparse=True)
+    ones = sp.sparse.kron(sp.sparse.identity(m), np.ones((1, k)))
+    dinv = np.array(diams, dtype=float)**-5
+    cost = np.outer(L, costs).ravel()
+    return B, ones, dinv, cost
+
+
+def _weymouth(L, q, dinv, C):
+    '''sparse rows of pressure loss over relative lengths, for flow
+    terms q (squared or signed f*|f|) on the arcs'''
+    return sp.sparse.kron(sp.sparse.diags(C * L * q), dinv.reshape(1, -1))
+
+
+def _linprog(c, A_eq, b_eq, bounds, verbose):
+    '''solve with sparse interior point, returns result or None'''
+    res = sp.optimize.linprog(c, A_eq=A_eq, b_eq=b_eq, bounds=bounds,
+                              method='interior-point',
+                              options={'sparse': True, 'disp': verbose})
+    if res.status != 0:
+        print 'Problem not solved:', res.message
+        return None
+    return res
+
+
+def _solve_linprog(N, A, L, flow, diams, costs, pres_bds, C, verbose):
+    '''LP assembled as sparse matrices, solved with scipy's linprog
+
+    Variables are the squared pressures (n), scaled like in
+    _build_vectorized, and the relative lengths (m x diameters, by arc).
+
+    returns squared pressures, relative lengths and objective value
+    (or None if not solved)
+    '''
+    n, m = len(N), len(A)
+    B, ones, dinv, cost = _lp_data(N, A, L, diams, costs)
+    scale = float(max(pres_bds))**2
+    q = np.array([flow[a] for a in A])**2 / scale
+
+    # Weymouth equations and convex combinations
+    A_eq = sp.sparse.bmat([[B, -_weymouth(L, q, dinv, C)], [None, ones]],
+                          format='csr')
+    b_eq = np.r_[np.zeros(m), np.ones(m)]
+
+    c = np.r_[np.zeros(n), cost]
+    bounds = [(min(pres_bds)**2 / scale, 1.0)]*n + [(0, None)]*len(cost)
+
+    res = _linprog(c, A_eq, b_eq, bounds, verbose)
+    if res is None:
+        return None, None, None
+    return scale * res.x[:n], res.x[n:].reshape(m, -1), res.fun
+
+
+def _frontier(diams, costs):
+    '''lower convex hull of the points (diams**-5, costs)
+
+    Mixing diameters along an arc, this is the cheapest cost (per
+    length) for a given pressure loss (per length and flow term).
+
+    returns arrays of the hull vertices, with increasing loss and
+    decreasing cost
+    '''
+    def turn(o, a, b):
+        return (a[0] - o[0])*(b[1] - o[1]) - (a[1] - o[1])*(b[0] - o[0])
+
+    hull = []
+    for p in sorted(zip(np.array(diams, dtype=float)**-5, costs)):
+        while len(hull) >= 2 and turn(hull[-2], hull[-1], p) <= 0:
+            hull.pop()
+        hull.append(p)
+
+    # more loss than at the cheapest diameter is of no use
+    k = int(np.argmin([c for _, c in hull]))
+    return np.array(hull[:k+1], dtype=float).T
+
+
+def _pl_sum(fs):
+    '''pointwise sum of convex piecewise linear functions
+
+    Functions are given as arrays of breakpoints and values, defined
+    from the first breakpoint on and constant after the last.
+    '''
+    start = max(f[0][0] for f in fs)
+    xs = np.unique(np.concatenate([[start]] + [f[0] for f in fs]))
+    xs = xs[xs >= start]
+    return xs, sum(np.interp(xs, *f) for f in fs)
+
+
+def _pl_infconv(f, g):
+    '''infimal convolution of convex piecewise linear functions
+
+    This is the cheapest split of the argument between f and g, found
+    by merging the segments of both functions by slope.
+    '''
+    dx = np.r_[np.diff(f[0]), np.diff(g[0])]
+    dv = np.r_[np.diff(f[1]), np.diff(g[1])]
+    order = np.argsort(dv / dx, kind='mergesort')
+    xs = f[0][0] + g[0][0] + np.r_[0.0, np.cumsum(dx[order])]
+    vs = f[1][0] + g[1][0] + np.r_[0.0, np.cumsum(dv[order])]
+    return xs, vs
+
+
+def _solve_tree(N, A, L, flow, diams, costs, pres_bds, C):
+    '''exact solution for flow from a single source, without an LP
+
+    Pressures only drop along the paths from the source, so it is set
+    to the upper bound, and the pressure drops along each path must fit
+    into the pressure range. The cheapest cost of a subtree, as a
+    function of the available drop, is convex piecewise linear. It is
+    built from the leaves up, by convolving the subtrees with the cost
+    frontier of the arcs and summing over the children of a node. The
+    available drop is then split top down.
+
+    returns squared pressures, diams**-5 of the equivalent diameters
+    and objective value (or None if infeasible)
+    '''
+    hx, hc = _frontier(diams, costs)
+    index = {n:i for i, n in enumerate(N)}
+    children = {n:[] for n in N}
+    for k, (u, v) in enumerate(A):
+        children[u].append((k, v))
+    heads = set(v for _, v in A)
+    order = [n for n in N if n not in heads]
+    assert len(order) == 1, 'not a single source'
+    for n in order:
+        order += [v for _, v in children[n]]
+
+    # cost of subtrees and arcs by pressure drop, from the leaves up
+    W = np.array([C * L[k] * flow[a]**2 for k, a in enumerate(A)])
+    point = (np.zeros(1), np.zeros(1))
+    sub, arc = {}, {}
+    for n in reversed(order):
+        fs = []
+        for k, v in children[n]:
+            arc[k] = (W[k] * hx, L[k] * hc) if W[k] > 0 else point
+            fs.append(_pl_infconv(arc[k], sub[v]))
+        sub[n] = _pl_sum(fs) if fs else point
+
+    lo, hi = min(pres_bds)**2, max(pres_bds)**2
+    root = order[0]
+    if sub[root][0][0] > hi - lo:
+        print 'Problem not solved: infeasible'
+        return None, None, None
+    obj = np.interp(hi - lo, *sub[root])
+
+    # split the available drop between arcs and subtrees, top down
+    pp = np.zeros(len(N))
+    x = np.zeros(len(A))
+    pp[index[root]] = hi
+    for n in order:
+        b = pp[index[n]] - lo
+        for k, v in children[n]:
+            f, g = arc[k], sub[v]
+            y = np.clip(np.r_[f[0], b - g[0]], f[0][0],
+                        min(f[0][-1], b - g[0][0]))
+            y = y[np.argmin(np.interp(y, *f) + np.interp(b - y, *g))]
+            x[k] = y / W[k] if W[k] > 0 else hx[0]
+            pp[index[v]] = pp[index[n]] - y
+    return pp, x, obj
+
+
+def solve(tree, flow, steiner_pos, diams, costs, pres_bds, C=1.0, verbose=False,
+          solver=None, vectorized=None, method='auto'):
     '''minimize diameter cost of a network with fixed node locations.
 
     args:
@@ -20,6 +258,14 @@ def solve(tree, flow, steiner_pos, diams, costs, pres_bds, C=1.0, verbose=False)
     - pres_bds    : uniform pressure bounds
     - C           : constant coefficient in Weymouth equation
     - verbose     : show solver output
+    - solver      : cvxpy solver name (default CVXOPT; the model is built
+                    for each call, so there is no warm start)
+    - vectorized  : build model with matrix variables (default) or scalar
+                    loops
+    - method      : 'tree' (exact, for flow from a single source),
+                    'cvxpy', 'linprog' (sparse LP with scipy) or 'auto'
+                    (tree if possible, else cvxpy; always cvxpy if solver
+                    or vectorized is given)
 
     returns:
     - equivalent diameters for each edge
@@ -31,8 +277,6 @@ def solve(tree, flow, steiner_pos, diams, costs, pres_bds, C=1.0, verbose=False)
 
     N = tree.get_nodes()
     A = tree.get_arcs()
-    I = range(len(diams))
-    AI = [(a,i) for a in A for i in I]
 
     assert all(flow[a] > 0.0 for a in A)
 
@@ -41,44 +285,231 @@ def solve(tree, flow, steiner_pos, diams, costs, pres_bds, C=1.0, verbose=False)
     pos.update(steiner_pos)
     assert all(n in pos for n in N)
 
-    L = {}
-    for a in A:
-        xu, xv = pos[a[0]], pos[a[1]]
-        L[a] = ((xu[0] - xv[0])**2 + (xu[1] - xv[1])**2)**0.5
+    L = arc_lengths(position_array(N, pos), arc_index_array(N, A))
+    dinv = np.array(diams, dtype=float)**-5
 
-    # squared pressure at node
-    pp = {n:cvx.Variable(1) for n in N}
+    if method == 'auto':
+        heads = [v for _, v in A]
+        single = len(set(heads)) == len(heads)
+        if single and solver is None and vectorized is None:
+            method = 'tree'
+        else:
+            method = 'cvxpy'
+    solver = cvx.CVXOPT if solver is None else solver
+    vectorized = True if vectorized is None else vectorized
 
-    # relative length of pipe segment for differnet diameters
-    l = {(a, i):cvx.Variable(1) for (a, i) in AI}
+    if method == 'tree':
+        pp, x, obj = _solve_tree(N, A, L, flow, diams, costs, pres_bds, C)
+    elif method == 'linprog':
+        pp, l, obj = _solve_linprog(N, A, L, flow, diams, costs, pres_bds, C,
+                                    verbose)
+        x = None if obj is None else l.dot(dinv)
+    elif method == 'cvxpy':
+        build = _build_vectorized if vectorized else _build_loops
+        prob, pp, l = build(N, A, L, flow, diams, costs, pres_bds, C)
+        prob.solve(solver=solver, verbose=verbose)
+        if prob.status == cvx.OPTIMAL:
+            pp = np.array([e.value for e in pp] if not vectorized
+                          else pp.value, dtype=float).ravel()
+            l = np.array([[e.value for e in row] for row in l]
+                         if not vectorized else l.value, dtype=float)
+            x = l.reshape(len(A), -1).dot(dinv)
+            obj = prob.value
+        else:
+            print 'Problem not solved:', prob.status
+            obj = None
+    else:
+        raise ValueError('unknown method: %s' % method)
 
-    conss = []
+    if obj is None:
+        return None, None, None
 
-    # pressure in bounds
-    for n in N:
-        conss += [pres_bds[0]**2 <= pp[n], pp[n] <= pres_bds[1]**2]
+    pres = dict(zip(N, np.sqrt(pp)))
+    diams = dict(zip(A, x**-0.2))
+    return diams, pres, obj
 
-    # relative lengths are convex combinations
-    for a in A:
-        conss += [sum(l[a, i] for i in I) == 1.0]
-        conss += [0 <= l[a, i] for i in I]
 
-    # Weymouth equation on pipes
-    for a in A:
-        u, v = a
-        cvx_comb = sum(diams[i]**(-5) * l[a, i] for i in I)
-        conss += [pp[u] - pp[v] == C * L[a] * flow[a]**2 * cvx_comb]
+def _robust_lp(B, ones, dinv, cost, L, Q, bds, C):
+    '''block LP for robust diameters in all scenarios
 
-    # minimize total pipe cost
-    obj = sum(L[a] * costs[i] * l[a,i] for (a,i) in AI)
+    Each scenario has its own squared pressures, while the relative
+    lengths are shared. The bounds are given for squared pressures.
+
+    returns cost vector, equality matrix and rhs, and variable bounds
+    '''
+    S = len(Q)
+    (m, n), k = B.shape, len(dinv)
+    W = [-_weymouth(L, q, dinv, C) for q in Q]
+    A_eq = sp.sparse.bmat([[sp.sparse.kron(sp.sparse.identity(S), B),
+                            sp.sparse.vstack(W)],
+                           [None, ones]], format='csr')
+    b_eq = np.r_[np.zeros(S*m), np.ones(m)]
+    c = np.r_[np.zeros(S*n), cost]
+    bounds = [(lo, hi) for lo, hi in bds for _ in range(n)]
+    return c, A_eq, b_eq, bounds + [(0, None)]*(m*k)
+
+
+def _scenarios_linprog(N, A, L, Q, diams, costs, bds, C, robust, verbose):
+    '''solve scenarios with scipy's linprog, see solve_scenarios
+
+    Squared pressures are scaled by the largest upper bound, like in
+    _scenarios_cvxpy.
+
+    returns list of squared pressures, relative lengths and objective
+    value for each scenario (or None if not solved)
+    '''
+    S, (n, m) = len(Q), (len(N), len(A))
+    B, ones, dinv, cost = _lp_data(N, A, L, diams, costs)
+    scale = float(bds.max())**2
+    Q, bds = Q / scale, bds**2 / scale
+
+    if robust:
+        res = _linprog(*(_robust_lp(B, ones, dinv, cost, L, Q, bds, C) +
+                         (verbose,)))
+        if res is None:
+            return [None]*S
+        l = res.x[S*n:].reshape(m, -1)
+        pps = scale * res.x[:S*n].reshape(S, n)
+        return [(pp, l, res.fun) for pp in pps]
+
+    # independent scenarios, only the Weymouth rows change
+    b_eq = np.r_[np.zeros(m), np.ones(m)]
+    c = np.r_[np.zeros(n), cost]
+    results = []
+    for q, (lo, hi) in zip(Q, bds):
+        A_eq = sp.sparse.bmat([[B, -_weymouth(L, q, dinv, C)], [None, ones]],
+                              format='csr')
+        bounds = [(lo, hi)]*n + [(0, None)]*len(cost)
+        res = _linprog(c, A_eq, b_eq, bounds, verbose)
+        results.append(None if res is None else
+                       (scale * res.x[:n], res.x[n:].reshape(m, -1), res.fun))
+    return results
+
+
+def _build_scenarios(B, L, diams, costs, S):
+    '''LP for S scenarios with common diameters, with parameters
+
+    Pressures are a (nodes x S) matrix, scaled like in
+    _build_vectorized. The flow coefficients of the Weymouth equations
+    and the pressure bounds are (arcs x S) and (nodes x S) parameters.
+
+    returns the problem, a dict of parameters and the expressions for
+    pressures and relative lengths
+    '''
+    (m, n), k = B.shape, len(diams)
+    dinv = np.array(diams, dtype=float)**-5
+    par = {'coef': cvx.Parameter(m, S),
+           'lo': cvx.Parameter(n, S), 'hi': cvx.Parameter(n, S)}
+
+    pp = cvx.Variable(n, S)
+    l = cvx.Variable(m, k)
+    loss = (l * dinv) * np.ones((1, S))
+
+    conss = [pp >= par['lo'], pp <= par['hi'],
+             l >= 0, l * np.ones(k) == 1.0,
+             B * pp == cvx.mul_elemwise(par['coef'], loss)]
+    obj = cvx.sum_entries(cvx.mul_elemwise(np.outer(L, costs), l))
 
     prob = cvx.Problem(cvx.Minimize(obj), conss)
-    opt = prob.solve(solver=cvx.CVXOPT, verbose=verbose)
+    return prob, par, pp, l
+
+
+def _scenarios_cvxpy(N, A, L, Q, diams, costs, bds, C, robust, verbose,
+                     solver):
+    '''solve scenarios with cvxpy, see solve_scenarios
+
+    Independent scenarios share one model with a single column, which
+    is built once and solved again for each scenario with new
+    parameters. Robust diameters are found with one stacked model.
+
+    returns list of squared pressures, relative lengths and objective
+    value for each scenario (or None if not solved)
+    '''
+    S, n = len(Q), len(N)
+    B = arc_incidence(N, A, sparse=True)
+    scale = float(bds.max())**2
+    coef = C * L[:, None] * Q.T / scale
+    lo, hi = bds[:, 0]**2 / scale, bds[:, 1]**2 / scale
+
+    groups = [range(S)] if robust else [[s] for s in range(S)]
+    prob, par, pp, l = _build_scenarios(B, L, diams, costs, len(groups[0]))
+    results = []
+    for g in groups:
+        par['coef'].value = coef[:, g]
+        par['lo'].value = np.ones((n, 1)) * lo[g]
+        par['hi'].value = np.ones((n, 1)) * hi[g]
+        prob.solve(solver=solver, verbose=verbose)
+        if prob.status != cvx.OPTIMAL:
+            print 'Problem not solved:', prob.status
+            results += [None]*len(g)
+            continue
+        pps = scale * np.asarray(pp.value, dtype=float).reshape(n, -1)
+        ls = np.asarray(l.value, dtype=float)
+        results += [(p, ls, prob.value) for p in pps.T]
+    return results
+
 
-    if prob.status == cvx.OPTIMAL:
-        pres = {n: pp[n].value**0.5 for n in N}
-        diams = {a: sum(diams[i]**(-5)*l[a,i].value for i in I)**(-0.2) for a in A}
-        return diams, pres, prob.value
+def solve_scenarios(tree, flows, steiner_pos, diams, costs, pres_bds, C=1.0,
+                    arcs=None, robust=False, verbose=False, solver=cvx.CVXOPT,
+                    method='cvxpy'):
+    '''minimize diameter cost for many flow scenarios at once.
+
+    The model is built once for the tree and node positions and only
+    the flows and pressure bounds are updated between scenarios. In
+    robust mode, all scenarios are merged into one block LP with common
+    diameters.
+
+    args:
+    - tree        : Steiner tree (fixed terminal positions)
+    - flows       : (scenarios x arcs) matrix of signed flows, e.g.
+                    from flow.find_arc_flows
+    - steiner_pos : positions for Steiner nodes
+    - diams       : diameter values (sorted increasingly)
+    - costs       : diameter cost factors
+    - pres_bds    : uniform pressure bounds, one pair for all scenarios
+                    or (scenarios x 2)
+    - C           : constant coefficient in Weymouth equation
+    - arcs        : arc order of flow columns (default: tree.get_arcs())
+    - robust      : choose one diameter per arc, feasible for all
+                    scenarios (otherwise each scenario is independent)
+    - verbose     : show solver output
+    - solver      : cvxpy solver name
+    - method      : 'cvxpy' or 'linprog' (sparse LP with scipy)
+
+    returns lists, with one entry per scenario (None if not solved):
+    - equivalent diameters for each arc (the same in robust mode)
+    - pressures at nodes
+    - objective value (total cost of the common diameters in robust mode)
+    '''
+    N = tree.get_nodes()
+    A = tree.get_arcs() if arcs is None else list(arcs)
+    F = np.atleast_2d(np.asarray(flows, dtype=float))
+    assert F.shape[1] == len(A)
+    bds = np.array(pres_bds, dtype=float).reshape(-1, 2) * np.ones((len(F), 1))
+
+    pos = merge_pos(tree, steiner_pos)
+    assert all(n in pos for n in N)
+    L = arc_lengths(position_array(N, pos), arc_index_array(N, A))
+
+    # pressure loss along the arc orientation, for signed flows
+    Q = F * np.abs(F)
+    if method == 'linprog':
+        results = _scenarios_linprog(N, A, L, Q, diams, costs, bds, C,
+                                     robust, verbose)
+    elif method == 'cvxpy':
+        results = _scenarios_cvxpy(N, A, L, Q, diams, costs, bds, C,
+                                   robust, verbose, solver)
     else:
-        print 'Problem not solved:', prob.status
-        return None, None. None
+        raise ValueError('unknown method: %s' % method)
+
+    dinv = np.array(diams, dtype=float)**-5
+    ds, ps, objs = [], [], []
+    for r in results:
+        if r is None:
+            ds.append(None), ps.append(None), objs.append(None)
+            continue
+        pp, l, obj = r
+        ds.append(dict(zip(A, l.dot(dinv)**-0.2)))
+        ps.append(dict(zip(N, np.sqrt(pp))))
+        objs.append(obj)
+    return ds, ps, objs
@@ -2,6 +2,8 @@
 Utilities for network flow
 '''
 
+from collections import namedtuple
+
 import networkx as nx
 import numpy as np
 import scipy as sp
@@ -32,6 +34,157 @@ def find_arc_flow(net, demand):
     sol = sp.sparse.linalg.spsolve(im, dem)
     return dict(zip(edgs, sol))
 
+def _tree_order(net):
+    '''Orient tree towards a root.
+
+    Returns list of (node, parent, arc) in BFS order, where arc is the
+    original arc connecting node and parent, or None if net is not a
+    (connected) tree.
+    '''
+    nodes = list(net.get_nodes())
+    arcs = list(net.get_arcs())
+    if len(arcs) != len(nodes) - 1:
+        return None
+    if not nodes:
+        return []
+
+    adj = {n:[] for n in nodes}
+    for a in arcs:
+        u, v = a
+        adj[u].append((v, a))
+        adj[v].append((u, a))
+
+    root = nodes[0]
+    order = [(root, None, None)]
+    seen = set([root])
+    for n, _, _ in order: # appending while iterating
+        for m, a in adj[n]:
+            if m not in seen:
+                seen.add(m)
+                order.append((m, n, a))
+    if len(order) != len(nodes):
+        return None
+    return order
+
+def find_tree_flow(net, demand):
+    '''Determine flow on arcs of a tree in linear time.
+
+    Accumulates demand from the leaves towards an arbitrary root. Falls
+    back to find_arc_flow if net is not a tree.
+
+    net: a (tree) network
+    demand: maps node IDs to demand (or supply if negative)
+    '''
+    order = _tree_order(net)
+    if order is None:
+        return find_arc_flow(net, demand)
+
+    assert sum(demand.values()) == 0.0, 'flow not balanced'
+
+    # net demand of subtree below each node
+    subdem = {n:float(demand.get(n, 0.0)) for n, _, _ in order}
+
+    flow = {}
+    for n, p, a in reversed(order[1:]):
+        # subtree demand must enter through the arc from the parent
+        flow[a] = subdem[n] if a[1] == n else -subdem[n]
+        subdem[p] += subdem[n]
+    return flow
+
+def arc_incidence(nodes, arcs, sparse=False):
+    '''Dense (arcs x nodes) matrix with +1 at tail and -1 at head.
+
+    Multiplied with node values (e.g. positions or pressures), it gives
+    the differences along the arcs. With sparse=True, a scipy.sparse
+    CSR matrix is returned instead.
+    '''
+    index = {n:i for i, n in enumerate(nodes)}
+    if sparse:
+        rows = np.repeat(np.arange(len(arcs)), 2)
+        cols = [index[n] for a in arcs for n in a]
+        vals = np.tile([1.0, -1.0], len(arcs))
+        return sp.sparse.csr_matrix((vals, (rows, cols)),
+                                    shape=(len(arcs), len(nodes)))
+    B = np.zeros((len(arcs), len(nodes)))
+    for k, (u, v) in enumerate(arcs):
+        B[k, index[u]] = 1.0
+        B[k, index[v]] = -1.0
+    return B
+
+TreeFlow = namedtuple('TreeFlow', ['nodes', 'arcs', 'matrix'])
+
+def tree_flow_matrix(net, nodes=None, arcs=None):
+    '''Precompute the linear map from node demands to arc flows.
+
+    On a tree, the flow on an arc is the net demand of the subtree
+    behind it, so the map is a (nodes x arcs) matrix with entries in
+    {-1, 0, 1}, nonzero for the arcs on the path to the root. It is
+    stored as a scipy.sparse CSR matrix. It only depends on the tree and
+    can be reused for any number of demand scenarios.
+
+    net: a tree network
+    nodes: node order for demand rows (default: sorted)
+    arcs: arc order for flow columns (default: sorted)
+
+    returns a TreeFlow with node and arc order and the matrix
+    '''
+    order = _tree_order(net)
+    assert order is not None, 'not a tree'
+
+    nodes = sorted(net.get_nodes()) if nodes is None else list(nodes)
+    arcs = sorted(net.get_arcs()) if arcs is None else list(arcs)
+    row = {n:i for i, n in enumerate(nodes)}
+    col = {a:j for j, a in enumerate(arcs)}
+
+    # walk up from each node, one entry per arc on the path to the root
+    parent = {}
+    rows, cols, vals = [], [], []
+    for n, p, a in order:
+        parent[n] = p, a
+        m = n
+        while p is not None:
+            rows.append(row[n])
+            cols.append(col[a])
+            vals.append(1.0 if a[1] == m else -1.0)
+            m = p
+            p, a = parent[m]
+
+    mat = sp.sparse.csr_matrix((vals, (rows, cols)),
+                               shape=(len(nodes), len(arcs)))
+    return TreeFlow(nodes, arcs, mat)
+
+def find_arc_flows(net, demands, tf=None):
+    '''Determine flow on arcs of a tree for many demand scenarios.
+
+    net: a tree network
+    demands: (scenarios x nodes) matrix, columns in order of tf.nodes
+    tf: TreeFlow of net, from tree_flow_matrix (computed if None)
+
+    returns (scenarios x arcs) matrix of flows, columns in order of
+    tf.arcs
+    '''
+    if tf is None:
+        tf = tree_flow_matrix(net)
+    demands = np.atleast_2d(np.asarray(demands, dtype=float))
+    assert demands.shape[1] == len(tf.nodes)
+    assert np.allclose(demands.sum(axis=1), 0.0), 'flow not balanced'
+
+    return np.asarray(tf.matrix.T.dot(demands.T).T)
+
+def make_forward_flows(flows):
+    '''Orientation for positive, forward flow in many scenarios.
+
+    args:
+    - flows: (scenarios x arcs) matrix of (signed) flow values
+
+    returns:
+    - matrix of orientation signs: 1 to keep arc, -1 to reverse it
+    - matrix of positive flow values on oriented arcs
+    '''
+    flows = np.asarray(flows, dtype=float)
+    signs = np.where(flows >= 0.0, 1, -1)
+    return signs, np.abs(flows)
+
 def make_forward_flow(tree, flow):
     '''Create tree with arcs oriented for positive, forward flow.
 
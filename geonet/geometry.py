@@ -45,3 +45,79 @@ def star_angles(center, leaves, pos):
 def distance(x1, x2):
     '''Euclidean distance'''
     return np.linalg.norm(np.array(x1) - np.array(x2))
+
+
+def position_array(nodes, pos):
+    '''(n, 2) array of node positions, rows in order of nodes'''
+    return np.array([pos[n] for n in nodes], dtype=float).reshape(-1, 2)
+
+
+def arc_index_array(nodes, arcs):
+    '''(m, 2) array of node indices (tail, head) of arcs'''
+    index = {n:i for i, n in enumerate(nodes)}
+    return np.array([(index[u], index[v]) for u, v in arcs],
+                    dtype=int).reshape(-1, 2)
+
+
+def arc_lengths(P, arcs):
+    '''Euclidean lengths of all arcs
+
+    args:
+    - P: (n, d) array of node positions
+    - arcs: (m, 2) array of node indices
+    '''
+    D = P[arcs[:, 1]] - P[arcs[:, 0]]
+    return np.sqrt((D**2).sum(axis=1))
+
+
+def angles_between(U, V):
+    '''Angles in radians between rows of 'U' and 'V'::
+
+            >>> angles_between([(1, 0), (1, 0)], [(0, 1), (-1, 0)])
+            array([1.57079633, 3.14159265])
+    '''
+    U, V = np.asarray(U, dtype=float), np.asarray(V, dtype=float)
+    cos = (U*V).sum(axis=-1) / np.sqrt((U**2).sum(axis=-1)*(V**2).sum(axis=-1))
+    return np.arccos(np.clip(cos, -1.0, 1.0))
+
+
+def all_star_angles(P, arcs, centers):
+    '''Angles between consecutive edges around many nodes at once
+
+    Around each center, the incident edges are sorted counterclockwise
+    by direction and the angles between neighboring edges are computed
+    (including the one between the last and the first edge, so that
+    the angles of a center sum to 2 pi).
+
+    args:
+    - P: (n, 2) array of node positions
+    - arcs: (m, 2) array of node indices
+    - centers: array of node indices
+
+    returns:
+    - center of each angle, sorted increasingly
+    - the angles, counterclockwise around each center
+    '''
+    centers = np.asarray(centers, dtype=int)
+    # directions of edges from both end nodes
+    tails = np.concatenate([arcs[:, 0], arcs[:, 1]])
+    heads = np.concatenate([arcs[:, 1], arcs[:, 0]])
+    keep = np.in1d(tails, centers)
+    tails, heads = tails[keep], heads[keep]
+    if len(tails) == 0:
+        return tails, np.zeros(0)
+    D = P[heads] - P[tails]
+    theta = np.arctan2(D[:, 1], D[:, 0])
+
+    order = np.lexsort((theta, tails))
+    tails, theta = tails[order], theta[order]
+
+    # angle to the next edge, wrapping around within each center
+    first = np.r_[True, tails[1:] != tails[:-1]]
+    start = np.maximum.accumulate(np.where(first, np.arange(len(tails)), 0))
+    last = np.r_[tails[1:] != tails[:-1], True]
+    nxt = np.where(last, start, np.arange(len(tails)) + 1)
+    angles = (theta[nxt] - theta) % (2*np.pi)
+    # a single edge spans the full circle
+    angles[last & first] = 2*np.pi
+    return tails, angles
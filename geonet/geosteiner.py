@@ -2,74 +2,249 @@
 Wrapper for GeoSteiner program
 '''
 
+from collections import OrderedDict
+import cPickle as pickle
+from functools import partial
+import hashlib
 from itertools import dropwhile, takewhile, ifilter
+from multiprocessing.pool import ThreadPool
 import os
-from subprocess import Popen, PIPE
+from subprocess import Popen, PIPE, CalledProcessError
+import tempfile
+from threading import Thread, Lock
 
 from geonet.network import SteinerTree
 
 # TODO: check if GeoSteiner is available
 
-def geosteiner(pos):
-    '''Call geosteiner to compute and return'''
-    def parse_ps(output):
-        lines = output.splitlines()
-        no_pre = dropwhile(lambda l:' % fs' not in l, lines)
-        end_kwds = ['Euclidean SMT', '(Steiner Minimal']
-        no_post = takewhile(lambda l: all(kw not in l for kw in end_kwds), no_pre)
-        filter_comments = ifilter(lambda l: ' % fs' not in l, no_post)
-        arcs = [l.split()[:4] for l in filter_comments]
-        return arcs
-
-    def build_tree(nodes, raw_arcs, pos):
-        _nodes = list(nodes)
-        _arcs = []
-        _steiner_pos = {}
-
-        num = 0
-        for ra in raw_arcs:
-            if ra[1] == 'T':
-                tail = nodes[int(ra[0])]
-            else: # must be Steiner node
-                coords = '_'.join(ra[0:2])
-                if coords in _steiner_pos:
-                    tail = _steiner_pos[coords]
-                else:
-                    node = '_%d' % num
-                    _nodes.append(node)
-                    tail = _steiner_pos.setdefault(coords, node)
-                    num += 1
-            if ra[3] == 'T':
-                head = nodes[int(ra[2])]
-            else: # must be Steiner node
-                coords = '_'.join(ra[2:4])
-                if coords in _steiner_pos:
-                    head = _steiner_pos[coords]
-                else:
-                    node = '_%d' % num
-                    _nodes.append(node)
-                    head = _steiner_pos.setdefault(coords, node)
-                    num += 1
-
-            _arcs.append((tail, head))
-
-        tree = SteinerTree(_nodes, _arcs, pos)
-
-        steiner_pos = {}
-        for k,v in _steiner_pos.items():
-            node = v
-            coords = k.split('_')
-            steiner_pos[node] = float(coords[0]), float(coords[1])
-
-        return tree, steiner_pos
+def _parse_ps(output):
+    '''extract raw arcs (tail and head, as index 'T' or coordinates)'''
+    lines = output.splitlines()
+    no_pre = dropwhile(lambda l:' % fs' not in l, lines)
+    end_kwds = ['Euclidean SMT', '(Steiner Minimal']
+    no_post = takewhile(lambda l: all(kw not in l for kw in end_kwds), no_pre)
+    filter_comments = ifilter(lambda l: ' % fs' not in l, no_post)
+    arcs = [l.split()[:4] for l in filter_comments]
+    return arcs
 
+def _build_tree(nodes, raw_arcs, pos):
+    '''Steiner tree and positions of Steiner nodes from raw arcs'''
+    _nodes = list(nodes)
+    _arcs = []
+    _steiner_pos = {}
+
+    num = 0
+    for ra in raw_arcs:
+        if ra[1] == 'T':
+            tail = nodes[int(ra[0])]
+        else: # must be Steiner node
+            coords = '_'.join(ra[0:2])
+            if coords in _steiner_pos:
+                tail = _steiner_pos[coords]
+            else:
+                node = '_%d' % num
+                _nodes.append(node)
+                tail = _steiner_pos.setdefault(coords, node)
+                num += 1
+        if ra[3] == 'T':
+            head = nodes[int(ra[2])]
+        else: # must be Steiner node
+            coords = '_'.join(ra[2:4])
+            if coords in _steiner_pos:
+                head = _steiner_pos[coords]
+            else:
+                node = '_%d' % num
+                _nodes.append(node)
+                head = _steiner_pos.setdefault(coords, node)
+                num += 1
+
+        _arcs.append((tail, head))
+
+    tree = SteinerTree(_nodes, _arcs, pos)
+
+    steiner_pos = {}
+    for k,v in _steiner_pos.items():
+        node = v
+        coords = k.split('_')
+        steiner_pos[node] = float(coords[0]), float(coords[1])
+
+    return tree, steiner_pos
+
+def _format(pos):
+    '''sorted terminal nodes and their input for GeoSteiner'''
     nodes = list(sorted(pos.keys()))
     nodeset = ''.join('%4d %4d\n' % pos[n] for n in nodes)
-    efst = Popen(['efst'], stdin=PIPE, stdout=PIPE)
-    efst_output, _ = efst.communicate(nodeset)
-    bb = Popen(['bb'], stdin=PIPE, stdout=PIPE)
-    output, _ = bb.communicate(efst_output)
-    raw_arcs = parse_ps(output)
-    tree, steiner_pos = build_tree(nodes, raw_arcs, pos)
+    return nodes, nodeset
+
+def _normalize(pos):
+    '''key and input for terminals translated to the origin
+
+    Coordinates are truncated to integers like in the input for
+    GeoSteiner, then shifted by their minimum and sorted, so that the
+    key only depends on the point set (not on node names or order).
+
+    returns sha1 key of the input, the input, the index (in sorted
+    node names) of each input point and the shift
+    '''
+    nodes = list(sorted(pos.keys()))
+    xy = [(int(pos[n][0]), int(pos[n][1])) for n in nodes]
+    dx, dy = min(x for x, _ in xy), min(y for _, y in xy)
+    perm = sorted(range(len(xy)), key=lambda i: xy[i])
+    nodeset = ''.join('%4d %4d\n' % (xy[i][0] - dx, xy[i][1] - dy)
+                      for i in perm)
+    return hashlib.sha1(nodeset).hexdigest(), nodeset, perm, (dx, dy)
+
+def _restore(raw_arcs, perm, dx, dy):
+    '''map terminal indices of raw arcs for normalized input back to the
+    sorted node names, and translate the Steiner node coordinates'''
+    restored = []
+    for ra in raw_arcs:
+        ra = list(ra)
+        for i in [0, 2]:
+            if ra[i + 1] == 'T':
+                ra[i] = str(perm[int(ra[i])])
+            elif dx != 0 or dy != 0:
+                ra[i] = repr(float(ra[i]) + dx)
+                ra[i + 1] = repr(float(ra[i + 1]) + dy)
+        restored.append(ra)
+    return restored
+
+class GeoSteinerCache(object):
+    '''Cache of GeoSteiner results, in memory (LRU) and optionally on disk
+
+    Keys are sha1 hashes of the GeoSteiner input for the terminals
+    translated to the origin and sorted, so that shifted or renamed
+    copies of an instance share an entry. Values are the arcs parsed from the output, from
+    which the tree and Steiner positions are built for the actual node
+    names and positions.
+
+    The numbers of hits (in memory or on disk) and misses are counted
+    in the attributes hits and misses.
+    '''
+
+    def __init__(self, maxsize=1024, path=None):
+        '''
+        args:
+        - maxsize : number of entries kept in memory
+        - path    : directory for pickled entries (None: memory only)
+        '''
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lru = OrderedDict()
+        self._lock = Lock()
+        if path is not None and not os.path.isdir(path):
+            os.makedirs(path)
+
+    def __len__(self):
+        return len(self._lru)
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.pkl')
+
+    def _insert(self, key, value):
+        self._lru[key] = value
+        while len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+
+    def get(self, key):
+        '''cached value for key (or None), marked as recently used'''
+        with self._lock:
+            value = self._lru.pop(key, None)
+            if value is None and self.path is not None:
+                try:
+                    with open(self._file(key), 'rb') as f:
+                        value = pickle.load(f)
+                except IOError:
+                    pass
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._insert(key, value)
+            return value
+
+    def put(self, key, value):
+        '''store value for key, in memory and on disk'''
+        with self._lock:
+            self._insert(key, value)
+        if self.path is not None:
+            # write to a temporary file first, for concurrent readers
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self._file(key))
+
+    def clear(self):
+        '''remove entries from memory (not from disk) and reset counts'''
+        with self._lock:
+            self._lru.clear()
+            self.hits = 0
+            self.misses = 0
+
+def _run(nodeset):
+    '''run the pipeline efst | bb on input, return output of bb'''
+    # close_fds: with threads, a child could inherit the write end of
+    # another pipeline's input (and that efst would never see EOF)
+    efst = Popen(['efst'], stdin=PIPE, stdout=PIPE, close_fds=True)
+    bb = Popen(['bb'], stdin=efst.stdout, stdout=PIPE, close_fds=True)
+    efst.stdout.close()
+
+    # feed input concurrently, so that no pipe can fill up and block
+    def feed():
+        efst.stdin.write(nodeset)
+        efst.stdin.close()
+    feeder = Thread(target=feed)
+    feeder.start()
+    output, _ = bb.communicate()
+    feeder.join()
+
+    for name, proc in [('efst', efst), ('bb', bb)]:
+        if proc.wait() != 0:
+            raise CalledProcessError(proc.returncode, name)
+    return output
+
+def geosteiner(pos, cache=None):
+    '''Call geosteiner to compute and return
+
+    With a GeoSteinerCache, results for the same terminal positions (up
+    to translation, whatever the node names) are reused instead of
+    calling GeoSteiner again.
+    '''
+    nodes, nodeset = _format(pos)
+    if cache is None:
+        raw_arcs = _parse_ps(_run(nodeset))
+    else:
+        key, nodeset, perm, shift = _normalize(pos)
+        raw_arcs = cache.get(key)
+        if raw_arcs is None:
+            raw_arcs = _parse_ps(_run(nodeset))
+            cache.put(key, raw_arcs)
+        raw_arcs = _restore(raw_arcs, perm, *shift)
+    tree, steiner_pos = _build_tree(nodes, raw_arcs, pos)
 
     return tree, steiner_pos
+
+def geosteiner_batch(pos_list, processes=None, cache=None):
+    '''Call geosteiner for many terminal sets.
+
+    The efst | bb pipelines are run concurrently, by a bounded pool of
+    threads that wait for the processes.
+
+    args:
+    - pos_list  : iterable of terminal positions (dicts)
+    - processes : number of concurrent pipelines (default: cpu count)
+    - cache     : GeoSteinerCache (shared by all threads) or None
+
+    returns list of tree and steiner_pos for each terminal set, in the
+    order of pos_list
+    '''
+    pos_list = list(pos_list)
+    pool = ThreadPool(processes)
+    try:
+        return pool.map(partial(geosteiner, cache=cache), pos_list,
+                        chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
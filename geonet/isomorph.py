@@ -14,81 +14,61 @@ def default_steiner_ids(n):
     return ['s%02d' % d for d in range(1, n - 1)]
 
 
+def canonical_form(net):
+    '''canonical form of an (undirected) forest
+
+    Isomorphic forests have the same form. Each tree is rooted at its
+    centre, found by peeling off leaves layer by layer, and encoded as
+    nested parentheses with sorted children (AHU). Trees with two
+    centres are encoded by both halves in brackets. The form of the
+    forest is the sorted tuple of the forms of its trees.
+    '''
+    adj = {n:set() for n in net.get_nodes()}
+    for u, v in net.get_arcs():
+        adj[u].add(v)
+        adj[v].add(u)
+    degree = {n:len(adj[n]) for n in adj}
+    children = {n:[] for n in adj}
+
+    forms = {}
+    trees = []
+    removed, paired = set(), set()
+    layer = [n for n in adj if degree[n] <= 1]
+    while layer:
+        for n in layer:
+            forms[n] = '(' + ''.join(sorted(children[n])) + ')'
+        current = set(layer)
+        next_layer = []
+        for n in layer:
+            rest = [m for m in adj[n] if m not in removed]
+            if not rest:
+                # single centre
+                trees.append(forms[n])
+            elif rest[0] in current:
+                # two centres, added by the first one
+                if n not in paired:
+                    paired.add(rest[0])
+                    halves = sorted([forms[n], forms[rest[0]]])
+                    trees.append('[' + ''.join(halves) + ']')
+            else:
+                m = rest[0]
+                children[m].append(forms[n])
+                degree[m] -= 1
+                if degree[m] == 1:
+                    next_layer.append(m)
+        removed.update(layer)
+        layer = next_layer
+
+    assert len(removed) == len(adj), 'not a forest'
+    return tuple(sorted(trees))
+
+
 def are_isomorphic(tree1, tree2):
     '''checks isomorphism for two given (undirected) trees
 
-    Implemented by uncritical copy from "Fampa et al.: A specialized
-    branch-and-bound algorithm for the Euclidean Steiner tree problem
-    in n-space", algorithm 2.
+    Compares the canonical forms, see canonical_form.
     '''
-    t1 = tree1.dg.to_undirected()
-    t2 = tree2.dg.to_undirected()
-
-    label1 = {}
-    label2 = {}
-    label = 1
-
-    # TODO: What about singletons? It seems to "just work".
-
-    # begin by labeling all leaves the same
-    leaves1 = [n for n in t1.nodes() if t1.degree(n) == 1]
-    leaves2 = [n for n in t2.nodes() if t2.degree(n) == 1]
-    if len(leaves1) != len(leaves2):
-        return False
-    for n in leaves1:
-        label1[n] = label
-    for n in leaves2:
-        label2[n] = label
-    label += 1
-
-    # add labels until difference or isomorphism found
-    while True:
-        # find unlabeled nodes with at most one unlabeled neighbor
-        next1, next2 = [], []
-        for n in t1.nodes():
-            if n in label1:
-                continue
-            if sum(m not in label1 for m in t1.neighbors(n)) <= 1:
-                next1.append(n)
-        for n in t2.nodes():
-            if n in label2:
-                continue
-            if sum(m not in label2 for m in t2.neighbors(n)) <= 1:
-                next2.append(n)
-        if len(next1) != len(next2):
-            return False
-
-        if next1 == []:
-            return True
-
-        # compute tentative labels as multiset of neighbors' labels
-        tent1, tent2 = [], []
-        for n in next1:
-            labels = [label1[m] for m in t1.neighbors(n) if m in label1]
-            tent1.append((sorted(labels), n))
-        for n in next2:
-            labels = [label2[m] for m in t2.neighbors(n) if m in label2]
-            tent2.append((sorted(labels), n))
-
-        # compare tentative labels
-        tent1.sort()
-        tent2.sort()
-        if any(t1[0] != t2[0] for t1, t2 in zip(tent1, tent2)):
-            return False
-
-        # add new labels
-        smallest = tent1[0][0]
-        for tl, n in tent1:
-            if tl == smallest:
-                label1[n] = label
-            else:
-                break
-        for tl, n in tent2:
-            if tl == smallest:
-                label2[n] = label
-            else:
-                break
-        label += 1
+    return canonical_form(tree1) == canonical_form(tree2)
 
 
 def enum_Steiner_only(n, steiner_ids=None):
@@ -108,6 +88,7 @@ def enum_Steiner_only(n, steiner_ids=None):
     # resulting data structures
     nclasses = {} # key: number of Steiner nodes
     reprtree = {} # key: (number of Steiner nodes, class id)
+    forms = set() # canonical forms of representatives
 
     # initialize with single representative for 1 Steiner node
     cur_nodes = steiner_ids[:1]
@@ -134,11 +115,12 @@ def enum_Steiner_only(n, steiner_ids=None):
                 cur_tree = Net(cur_nodes, cur_edges)
 
                 # skip tree if isomorphic to other representative
-                if any(are_isomorphic(cur_tree, reprtree[j, l])
-                       for l in range(nclasses[j])):
+                form = canonical_form(cur_tree)
+                if form in forms:
                     continue
 
                 # add representative for new class
+                forms.add(form)
                 reprtree[j, nclasses[j]] = cur_tree
                 nclasses[j] += 1
 
@@ -184,13 +166,60 @@ def label_fst(tree):
     return label[h]
 
 
-def enum(term_pos, steiner_ids=None):
-    '''Enumerate all representative full steiner trees.
+def code_fst(tree):
+    '''Computes a compact integer labeling of a Full Steiner Tree.
+
+    Like label_fst, the label is the same exactly for isomorphic trees
+    (with the same terminals), but it is a single int instead of nested
+    tuples, which is cheaper to hash, compare and store.
+
+    The rooted binary tree of label_fst is written in preorder: a 1 bit
+    for each Steiner node, a 0 bit and the index of the terminal (among
+    the sorted terminals, with fixed width) for each leaf. The children
+    of each Steiner node are ordered by their codes.
+    '''
+    assert isinstance(tree, SteinerTree)
+    terms = sorted(tree.get_terminal_nodes())
+    width = max(1, (len(terms) - 1).bit_length())
+
+    # pairs (value, number of bits), starting with the leaves
+    code = {}
+    for i, t in enumerate(terms):
+        code[t] = (i, 1 + width)
+
+    root = terms[0]
+
+    # set codes for all Steiner nodes
+    g = tree.dg.to_undirected()
+    bfs = list(nx.bfs_edges(g, root))[::-1]
+    for i in range(len(bfs)/2):
+        t1, h1 = bfs[2*i]
+        t2, h2 = bfs[2*i + 1]
+        assert t1 == t2
+        assert tree.is_steiner(t1)
+        assert t1 not in code
+        (v1, n1), (v2, n2) = sorted([code[h1], code[h2]])
+        code[t1] = ((1 << n1 + n2) | (v1 << n2) | v2, 1 + n1 + n2)
+
+    # return code of Steiner node adjacent to root
+    t, h = bfs[-1]
+    assert t == root
+    assert tree.is_steiner(h)
+    return code[h][0]
+
+
+def iter_enum(term_pos, steiner_ids=None, label=label_fst):
+    '''Generate all representative full steiner trees.
+
+    Yields pairs (label, tree) as soon as a new class is found. Only the
+    integer codes (see code_fst) of classes already seen are kept, not
+    the trees.
 
     - term_pos: a dict mapping terminal node IDs to their (fixed)
     positions.
     - steiner_ids: optional list of Steiner node IDs. Must be of correct
     length.
+    - label: labeling function for yielded trees, e.g. code_fst.
 
     Following "Fampa et al.: A specialized branch-and-bound algorithm
     for the Euclidean Steiner tree problem in n-space", algorithm 3.
@@ -203,20 +232,20 @@ def enum(term_pos, steiner_ids=None):
     ns = nt - 2
     assert len(steiner_ids) == ns
 
-    # compute all representative trees connecting the Steiner nodes
-    nclasses, reprtree = enum_Steiner_only(len(terms), steiner_ids)
-    nc = nclasses[ns]
-
-    # resulting data structure of representatives, indexed by label
-    trees = {}
-
     # special case: 3 terminals, 1 Steiner node
     if nt == 3:
         s = steiner_ids[0]
         edges = [(t, s) for t in terms]
         tree = SteinerTree(terms + steiner_ids, edges, term_pos)
-        trees[label_fst(tree)] = tree
-        return trees
+        yield label(tree), tree
+        return
+
+    # compute all representative trees connecting the Steiner nodes
+    nclasses, reprtree = enum_Steiner_only(len(terms), steiner_ids)
+    nc = nclasses[ns]
+
+    # labels of representatives found so far
+    seen = set()
 
     # for each class of 'inner tree'
     for c in range(nc):
@@ -231,9 +260,10 @@ def enum(term_pos, steiner_ids=None):
 
         # (naive) enumeration of all permutations of terminals
         for perm in permutations(terms):
-            # TODO: skip those permutations that yield the same tree,
-            # i.e. where two terminals are swapped that are connected to
-            # the same degree-1 Steiner node
+            # NOTE: many permutations yield the same tree, e.g. where two
+            # terminals are swapped that are connected to the same
+            # degree-1 Steiner node. See iter_enum_orderly for a
+            # generation without duplicates.
 
             # connect all terminals to Steiner nodes in permutation order
             new_edges = []
@@ -246,12 +276,85 @@ def enum(term_pos, steiner_ids=None):
             new_tree = SteinerTree(cur_nodes, cur_edges + new_edges, term_pos)
 
             # check if isomorphic to saved tree
-            label = label_fst(new_tree)
-            if label in trees:
+            code = code_fst(new_tree)
+            if code in seen:
                 # TODO: select lexicographically smaller tree
                 continue
 
-            # save tree
-            trees[label] = new_tree
+            # new representative
+            seen.add(code)
+            yield (code if label is code_fst else label(new_tree)), new_tree
+
+
+def enum(term_pos, steiner_ids=None, label=label_fst):
+    '''Enumerate all representative full steiner trees.
+
+    Returns a dict of trees, indexed by label. See iter_enum.
+    '''
+    return dict(iter_enum(term_pos, steiner_ids, label))
+
+
+def count_fsts(n):
+    '''Number of full Steiner tree topologies for n terminals'''
+    count = 1
+    for k in range(3, n):
+        count *= 2*k - 3
+    return count
+
 
-    return trees
+def iter_enum_orderly(term_pos, steiner_ids=None, start=0, label=label_fst):
+    '''Generate all full steiner trees, each exactly once.
+
+    Yields pairs (label, tree) like iter_enum, but without producing
+    duplicates that need to be recognized by their labels.
+
+    Starting from the star on the first three terminals, every further
+    terminal is attached to a new Steiner node subdividing one of the
+    existing edges. Each FST is built by exactly one sequence of edge
+    choices, so no isomorphism check is needed.
+
+    The trees are generated in a fixed order, numbered from 0 to
+    count_fsts(n) - 1, so that enumeration can continue from a given
+    index.
+
+    - term_pos: a dict mapping terminal node IDs to their (fixed)
+    positions.
+    - steiner_ids: optional list of Steiner node IDs. Must be of correct
+    length.
+    - start: index of first tree to generate.
+    - label: labeling function for yielded trees, e.g. code_fst.
+    '''
+    terms = sorted(term_pos.keys())
+    nt = len(terms)
+    assert nt >= 3
+    if steiner_ids is None:
+        steiner_ids = default_steiner_ids(nt)
+    assert len(steiner_ids) == nt - 2
+
+    nodes = terms + list(steiner_ids)
+
+    # k-th terminal can be inserted into any of the 2k - 3 edges
+    radices = [2*k - 3 for k in range(3, nt)]
+    total = count_fsts(nt)
+    index = start
+    while index < total:
+        # decode index into edge choices, last one varies fastest
+        edge_seq = []
+        rest = index
+        for r in reversed(radices):
+            rest, e = divmod(rest, r)
+            edge_seq.append(e)
+        edge_seq.reverse()
+        index += 1
+
+        s = steiner_ids[0]
+        edges = [(t, s) for t in terms[:3]]
+        for k, e in enumerate(edge_seq, 3):
+            s = steiner_ids[k - 2]
+            u, v = edges[e]
+            edges[e] = (u, s)
+            edges.append((s, v))
+            edges.append((terms[k], s))
+
+        tree = SteinerTree(nodes, edges, term_pos)
+        yield label(tree), tree
@@ -7,27 +7,25 @@ Solved as second-order cone program with cvxpy.
 import cvxpy as cvx
 import numpy as np
 
-from geonet.flow import make_forward_flow
+from geonet.flow import make_forward_flow, arc_incidence
 
-def steiner_pos(tree, flow, diams, costs, pres_bds, C=1.0, verbose=False):
-    '''minimize diameter cost of network with junction locations.
 
-    args:
-    - tree     : Steiner tree (fixed terminal positions)
-    - flow     : dict from arc tuple (assumed positive)
-    - diams    : diameter values (sorted increasingly)
-    - costs    : diameter cost factors
-    - pres_bds : uniform pressure bounds
-    - C        : constant coefficient in Weymouth equation
-    - verbose  : show solver output
+def _segment_coefs(diams, costs):
+    '''coefficients of the cones for the diameter segments'''
+    assert len(diams) == len(costs)
+    N = len(diams)
+    J = list(range(N - 1))
+    gg = [(costs[j+1]*diams[j]**-5 - costs[j]*diams[j+1]**-5) for j in J]
+    ee = [(costs[j+1] - costs[j])/gg[j] for j in J]
+    ff = [(diams[j]**-5 - diams[j+1]**-5)/gg[j] for j in J]
+    return ee, ff
 
-    returns:
-    - positions of Steiner nodes
-    - value of objective in solution
-    '''
-    tree, flow = make_forward_flow(tree, flow)
-    assert all(flow[a] > 0.0 for a in tree.get_arcs())
 
+def _build_loops(tree, flow, diams, costs, pres_bds, C):
+    '''SOCP with variables and cones per node, arc and segment
+
+    returns the problem and the position expressions of the nodes
+    '''
     # Node positions
     x = {n:cvx.Variable(2) for n in tree.get_nodes()}
 
@@ -44,12 +42,8 @@ def steiner_pos(tree, flow, diams, costs, pres_bds, C=1.0, verbose=False):
     # second order cone constraints
     socs = []
 
-    assert len(diams) == len(costs)
-    N = len(diams)
-    J = list(range(N - 1))
-    gg = [(costs[j+1]*diams[j]**-5 - costs[j]*diams[j+1]**-5) for j in J]
-    ee = [(costs[j+1] - costs[j])/gg[j] for j in J]
-    ff = [(diams[j]**-5 - diams[j+1]**-5)/gg[j] for j in J]
+    ee, ff = _segment_coefs(diams, costs)
+    J = list(range(len(diams) - 1))
 
     for a in tree.get_arcs():
         u, v = a
@@ -79,10 +73,198 @@ def steiner_pos(tree, flow, diams, costs, pres_bds, C=1.0, verbose=False):
     # minimize total cost
     obj = sum(t[a] for a in tree.get_arcs())
     prob = cvx.Problem(cvx.Minimize(obj), conss)
-    opt = prob.solve(solver=cvx.CVXOPT, verbose=verbose)
+    return prob, x
+
+
+def _build_vectorized(tree, flow, diams, costs, pres_bds, C):
+    '''SOCP with matrix variables and stacked cones over all arcs
+
+    returns the problem and the position expressions of the nodes
+    '''
+    nodes = tree.get_nodes()
+    arcs = tree.get_arcs()
+    terms = [i for i, n in enumerate(nodes) if tree.is_terminal(n)]
+    B = arc_incidence(nodes, arcs)
+    q = C * np.array([flow[a] for a in arcs])**2
+
+    # Node positions, pressures (squared) and arc costs (in units of
+    # the smallest diameter's cost, for better numerical scaling)
+    X = cvx.Variable(len(nodes), 2)
+    pp = cvx.Variable(len(nodes))
+    t = cvx.Variable(len(arcs))
+
+    # fix positions of terminals (selected rows of X)
+    S = np.eye(len(nodes))[terms, :]
+    P = np.array([tree.get_position(nodes[i]) for i in terms], dtype=float)
+    fixed_pos = [S*X == P]
+
+    # arc lengths and pressure differences
+    L = cvx.norm(B*X, 2, axis=1)
+    dp = B*pp
+
+    # second order cone constraints, stacked over arcs
+    ee, ff = _segment_coefs(diams, costs)
+    socs = [L <= cvx.mul_elemwise(e/q, dp) + (f*costs[0])*t
+            for e, f in zip(ee, ff)]
+    socs.append(L <= cvx.mul_elemwise(diams[-1]**5/q, dp))
+    socs.append(L <= t)
+
+    # pressure bounds
+    pres = [pp >= min(pres_bds)**2, pp <= max(pres_bds)**2]
+
+    prob = cvx.Problem(cvx.Minimize(costs[0]*cvx.sum_entries(t)),
+                       fixed_pos + socs + pres)
+    x = {n:X[i, :] for i, n in enumerate(nodes)}
+    return prob, x
+
+
+def _solve(prob, solver, verbose, warm_start=False):
+    '''solve problem, refining inaccurate solutions
+
+    First-order solvers like SCS (the only one that can be warm
+    started) often stop with an inaccurate solution. It is then solved
+    again, from scratch, with the default solver CVXOPT.
+    '''
+    prob.solve(solver=solver, verbose=verbose, warm_start=warm_start)
+    if prob.status == cvx.OPTIMAL_INACCURATE and solver != cvx.CVXOPT:
+        prob.solve(solver=cvx.CVXOPT, verbose=verbose)
+
+
+class SteinerPosTemplate(object):
+    '''Parametrized model of steiner_pos for trees of the same shape
+
+    The problem is built (and canonicalized by cvxpy) only once. The
+    incidence structure, flows, terminal positions, diameter data and
+    pressure bounds are parameters that are set for each tree before
+    solving.
+
+    Since the same problem is solved again, solvers that support it
+    (e.g. SCS) can be warm started from the previous solution, which
+    helps for similar trees or demand scenarios.
+    '''
+
+    def __init__(self, nnodes, narcs, nterms, ndiams):
+        self.shape = nnodes, narcs, nterms, ndiams
+
+        # incidence, terminal positions, pressure bounds
+        self.B = cvx.Parameter(narcs, nnodes)
+        self.P = cvx.Parameter(nterms, 2)
+        self.pres_min = cvx.Parameter(sign='positive')
+        self.pres_max = cvx.Parameter(sign='positive')
+
+        # coefficients of the cones, depending on flow and diameters
+        self.E = [cvx.Parameter(narcs) for j in range(ndiams - 1)]
+        self.F = [cvx.Parameter() for j in range(ndiams - 1)]
+        self.H = cvx.Parameter(narcs)
+        self.cost = cvx.Parameter(sign='positive')
+
+        # Node positions (terminals first), pressures (squared) and arc
+        # costs (in units of the smallest diameter's cost)
+        self.X = cvx.Variable(nnodes, 2)
+        self.pp = cvx.Variable(nnodes)
+        self.t = cvx.Variable(narcs)
+
+        L = cvx.norm(self.B*self.X, 2, axis=1)
+        dp = self.B*self.pp
+
+        conss = [self.X[:nterms, :] == self.P]
+        conss += [L <= cvx.mul_elemwise(E, dp) + F*self.t
+                  for E, F in zip(self.E, self.F)]
+        conss.append(L <= cvx.mul_elemwise(self.H, dp))
+        conss.append(L <= self.t)
+        conss += [self.pp >= self.pres_min, self.pp <= self.pres_max]
+
+        obj = self.cost*cvx.sum_entries(self.t)
+        self.prob = cvx.Problem(cvx.Minimize(obj), conss)
+
+    def solve(self, tree, flow, diams, costs, pres_bds, C=1.0, verbose=False,
+              solver=cvx.CVXOPT, warm_start=False):
+        '''set parameters for tree and solve, see steiner_pos'''
+        tree, flow = make_forward_flow(tree, flow)
+        assert all(flow[a] > 0.0 for a in tree.get_arcs())
+
+        nodes = tree.get_terminal_nodes() + tree.get_steiner_nodes()
+        arcs = tree.get_arcs()
+        assert self.shape == (len(nodes), len(arcs),
+                              len(tree.get_terminal_nodes()), len(diams))
+        q = C * np.array([flow[a] for a in arcs])**2
+
+        self.B.value = arc_incidence(nodes, arcs)
+        self.P.value = np.array([tree.get_position(t) for t in
+                                 tree.get_terminal_nodes()], dtype=float)
+        self.pres_min.value = min(pres_bds)**2
+        self.pres_max.value = max(pres_bds)**2
+
+        ee, ff = _segment_coefs(diams, costs)
+        for E, F, e, f in zip(self.E, self.F, ee, ff):
+            E.value = e/q
+            F.value = f*costs[0]
+        self.H.value = diams[-1]**5/q
+        self.cost.value = costs[0]
+
+        _solve(self.prob, solver, verbose, warm_start)
+
+        if self.prob.status == cvx.OPTIMAL:
+            X = np.asarray(self.X.value)
+            pos = {n:X[i, :].tolist() for i, n in enumerate(nodes)}
+            return pos, self.prob.value
+        else:
+            print 'Problem not solved:', self.prob.status
+            return None, None
+
+
+# templates by shape (nodes, arcs, terminals, diameters)
+_templates = {}
+
+def get_template(nnodes, narcs, nterms, ndiams):
+    '''shared SteinerPosTemplate for given shape, created on first use'''
+    key = nnodes, narcs, nterms, ndiams
+    if key not in _templates:
+        _templates[key] = SteinerPosTemplate(*key)
+    return _templates[key]
+
+
+def steiner_pos(tree, flow, diams, costs, pres_bds, C=1.0, verbose=False,
+                vectorized=True, template=False, solver=cvx.CVXOPT,
+                warm_start=False):
+    '''minimize diameter cost of network with junction locations.
+
+    args:
+    - tree       : Steiner tree (fixed terminal positions)
+    - flow       : dict from arc tuple (assumed positive)
+    - diams      : diameter values (sorted increasingly)
+    - costs      : diameter cost factors
+    - pres_bds   : uniform pressure bounds
+    - C          : constant coefficient in Weymouth equation
+    - verbose    : show solver output
+    - vectorized : build model with matrix variables (or scalar loops)
+    - template   : reuse model built for trees of the same shape
+    - solver     : cvxpy solver name
+    - warm_start : start from previous solution of the template (needs
+                   template and a solver supporting it, e.g. cvx.SCS);
+                   inaccurate solutions are solved again with CVXOPT
+
+    returns:
+    - positions of Steiner nodes
+    - value of objective in solution
+    '''
+    if template:
+        shape = (len(tree.get_nodes()), len(tree.get_arcs()),
+                 len(tree.get_terminal_nodes()), len(diams))
+        return get_template(*shape).solve(tree, flow, diams, costs,
+                                          pres_bds, C, verbose, solver,
+                                          warm_start)
+
+    tree, flow = make_forward_flow(tree, flow)
+    assert all(flow[a] > 0.0 for a in tree.get_arcs())
+
+    build = _build_vectorized if vectorized else _build_loops
+    prob, x = build(tree, flow, diams, costs, pres_bds, C)
+    _solve(prob, solver, verbose)
 
     if prob.status == cvx.OPTIMAL:
-        pos = {n:np.array(x[n].value)[:, 0].tolist() for n in tree.get_nodes()}
+        pos = {n:np.asarray(x[n].value).ravel().tolist()
+               for n in tree.get_nodes()}
         return pos, prob.value
     else:
         print 'Problem not solved:', prob.status
@@ -5,34 +5,218 @@ Minimize transport (momentum).
 import cvxpy as cvx
 import numpy as np
 
-def steiner_pos(tree, flows, flow_exp=1.0, verbose=False):
+from geonet.constants import abstol
+from geonet.flow import arc_incidence
+
+def _build_loops(tree, nodes, arcs, flows, flow_exp):
+    '''problem with a variable per node and a norm per arc'''
+    # create variables for 2d-positions
+    x = {n:cvx.Variable(2) for n in nodes}
+
+    # fix positions of terminals
+    fixed_pos = [x[n] == np.array(tree.dg.node[n]['pos'])
+                 for n in nodes
+                 if tree.is_terminal(n)]
+
+    constraints = fixed_pos
+
+    obj = sum(flows[u,v]**flow_exp * cvx.norm2(x[u] - x[v]) for u,v in arcs)
+    prob = cvx.Problem(cvx.Minimize(obj), constraints)
+    return prob, x
+
+def _build_vectorized(tree, nodes, arcs, flows, flow_exp):
+    '''problem with a matrix variable and stacked norms over all arcs'''
+    terms = [i for i, n in enumerate(nodes) if tree.is_terminal(n)]
+    B = arc_incidence(nodes, arcs)
+    w = np.array([flows[a]**flow_exp for a in arcs])
+
+    # create variable for 2d-positions (one row per node)
+    X = cvx.Variable(len(nodes), 2)
+
+    # fix positions of terminals (selected rows of X)
+    S = np.eye(len(nodes))[terms, :]
+    P = np.array([tree.get_position(nodes[i]) for i in terms], dtype=float)
+    constraints = [S*X == P]
+
+    obj = w * cvx.norm(B*X, 2, axis=1)
+    prob = cvx.Problem(cvx.Minimize(obj), constraints)
+    x = {n:X[i, :] for i, n in enumerate(nodes)}
+    return prob, x
+
+def _smoothed_length(Bs, D, w, X, delta):
+    '''weighted sum of smoothed arc lengths sqrt(l**2 + delta**2)'''
+    V = np.matmul(Bs, X) + D
+    return (w * np.sqrt((V**2).sum(axis=-1) + delta**2)).sum(axis=-1)
+
+def _weiszfeld(Bs, D, w, tol, maxiter):
+    '''Newton-Weiszfeld iteration for a batch of trees
+
+    The arc lengths are smoothed to sqrt(l**2 + delta**2), so that nodes
+    collapsing onto each other (degenerate solutions) keep finite
+    derivatives. The Weiszfeld (Smith) step for all Steiner nodes solves
+    a linear system with the isotropic part w/r of the Hessian of each
+    arc. Here, also the radial part is included, which gives a Newton
+    step with quadratic convergence; a step size is picked from a fixed
+    halving sequence. Delta starts at the scale of the instance and is
+    reduced tenfold whenever the iteration has converged for it.
+
+    args:
+    - Bs: (k, m, s) incidence of arcs and Steiner nodes
+    - D: (k, m, 2) fixed part of arc vectors, from terminal positions
+    - w: (k, m) nonnegative arc weights
+    - tol: stop when no node moves more than this (for smallest delta)
+    - maxiter: maximum number of iterations
+
+    returns (k, s, 2) array of Steiner node positions and (k,) boolean
+    mask of trees that converged within maxiter
+    '''
+    k, m, s = Bs.shape
+    steps = 0.5**np.arange(20)[:, None, None, None]
+    I = np.eye(2)
+
+    # arcs without flow have no curvature, which makes the Hessian
+    # singular; a tiny weight keeps their Steiner nodes in place. Any
+    # positions are optimal without flow at all, those for unit weights
+    # are taken.
+    wmax = w.max(axis=1, keepdims=True)
+    w = np.where(wmax > 0, np.maximum(w, 1e-9 * wmax), 1.0)
+
+    # initial positions: Weiszfeld step for equal arc lengths
+    BsT = Bs.transpose(0, 2, 1)
+    A = np.matmul(BsT, w[..., None] * Bs)
+    X = np.linalg.solve(A, -np.matmul(BsT, w[..., None] * D))
+
+    # smoothing per tree, trees are dropped from the batch when done
+    delta_min = 0.1 * tol
+    delta = np.maximum(0.01 * np.abs(D).max(axis=(1, 2)), delta_min)
+    active = np.arange(k)
+    for _ in range(maxiter):
+        if len(active) == 0:
+            break
+        Bs_, D_, w_, X_ = Bs[active], D[active], w[active], X[active]
+        BsT = Bs_.transpose(0, 2, 1)
+        d = delta[active]
+
+        V = np.matmul(Bs_, X_) + D_
+        r = np.sqrt((V**2).sum(axis=-1) + d[:, None]**2)
+        G = np.matmul(BsT, (w_ / r)[..., None] * V)
+
+        # Hessian blocks of the arcs, assembled as (2s, 2m) x (2m, 2s)
+        Ha = ((w_ / r)[..., None, None] * I
+              - (w_ / r**3)[..., None, None] * V[..., :, None] * V[..., None, :])
+        left = BsT[:, :, None, :, None] * Ha.transpose(0, 2, 1, 3)[:, None]
+        right = Bs_[:, :, None, :, None] * I[:, None, :]
+        H = np.matmul(left.reshape(-1, 2*s, 2*m), right.reshape(-1, 2*m, 2*s))
+
+        # small ridge (relative to the diagonal) against round-off
+        i = np.arange(2*s)
+        H[:, i, i] *= 1 + 1e-10
+        P = np.linalg.solve(H, G.reshape(-1, 2*s, 1)).reshape(-1, s, 2)
+        obj = _smoothed_length(Bs_, D_, w_, X_ - steps*P, d[:, None])
+        best = np.argmin(obj, axis=0)
+        t = steps[best, 0]
+
+        # plain Weiszfeld step (never increasing) where the Newton step
+        # fails to descend, for badly conditioned Hessians
+        fail = (obj[best, np.arange(len(active))] >=
+                _smoothed_length(Bs_, D_, w_, X_, d[:, None]))
+        if fail.any():
+            Aw = np.matmul(BsT[fail], (w_ / r)[fail][..., None] * Bs_[fail])
+            P[fail] = np.linalg.solve(Aw, G[fail])
+            t[fail] = 1.0
+        X[active] = X_ - t * P
+
+        move = (t * np.abs(P)).max(axis=(1, 2))
+        conv = move < np.maximum(tol, d)
+        done = conv & (d <= delta_min) & (move < tol)
+        delta[active] = np.where(conv, np.maximum(0.1 * d, delta_min), d)
+        active = active[~done]
+
+    converged = np.ones(k, dtype=bool)
+    converged[active] = False
+    converged &= np.isfinite(X).all(axis=(1, 2))
+    return X, converged
+
+def _batch_arrays(tree, flows, flow_exp):
+    '''incidence, fixed arc vectors and weights for _weiszfeld'''
+    terms = sorted(tree.get_terminal_nodes())
+    steiner = sorted(tree.get_steiner_nodes())
+    arcs = sorted(tree.get_arcs())
+    B = arc_incidence(terms + steiner, arcs)
+    P = np.array([tree.get_position(t) for t in terms], dtype=float)
+    w = np.array([abs(flows[a])**flow_exp for a in arcs], dtype=float)
+    return B[:, len(terms):], B[:, :len(terms)].dot(P), w
+
+def steiner_pos_batch(trees, flows, flow_exp=1.0, tol=abstol/100,
+                      maxiter=500, solver=cvx.ECOS):
+    '''minimize flow-weighted length for many trees, with NumPy only
+
+    Trees with the same numbers of terminals and Steiner nodes are
+    solved together, with stacked arrays. Trees for which the iteration
+    does not converge are solved again with cvxpy (see steiner_pos).
+
+    args:
+    - trees: list of steiner trees (with terminal positions)
+    - flows: list of dicts from arc tuple
+    - flow_exp: exponent of flow in objective coefficients
+    - tol: convergence tolerance for node positions
+    - maxiter: maximum number of iterations
+    - solver: cvxpy solver for trees that did not converge
+
+    returns list of dicts of positions from node to list
+    '''
+    assert len(trees) == len(flows)
+    groups = {}
+    for i, tree in enumerate(trees):
+        shape = len(tree.get_terminal_nodes()), len(tree.get_steiner_nodes())
+        groups.setdefault(shape, []).append(i)
+
+    sols = [None] * len(trees)
+    for group in groups.values():
+        arrays = [_batch_arrays(trees[i], flows[i], flow_exp) for i in group]
+        Bs, D, w = [np.array(a) for a in zip(*arrays)]
+        if Bs.shape[2] > 0:
+            X, converged = _weiszfeld(Bs, D, w, tol, maxiter)
+        else:
+            converged = np.ones(len(group), dtype=bool)
+        for j, i in enumerate(group):
+            tree = trees[i]
+            if not converged[j]:
+                sols[i] = steiner_pos(tree, flows[i], flow_exp, solver=solver)
+                continue
+            sol = {t:list(tree.get_position(t))
+                   for t in tree.get_terminal_nodes()}
+            for k, n in enumerate(sorted(tree.get_steiner_nodes())):
+                sol[n] = X[j, k].tolist()
+            sols[i] = sol
+    return sols
+
+def steiner_pos(tree, flows, flow_exp=1.0, verbose=False, vectorized=True,
+                solver=cvx.CVXOPT, method='cvxpy'):
     '''minimize flow-weighted length of network with steiner positions
 
     args:
     - tree: steiner tree (with terminal positions)
     - flows: dict from arc tuple
     - flow_exp: exponent of flow in objective coefficients
+    - vectorized: build model with matrix variables (or scalar loops)
+    - solver: cvxpy solver name (the model is built for each call, so
+              there is no warm start, unlike junction_loc templates)
+    - method: 'cvxpy' (conic solver) or 'weiszfeld' (see steiner_pos_batch)
 
     returns dict of positions from node to tuple
     '''
-    # TODO: rewrite with vector notation an no loops
+    if method == 'weiszfeld':
+        return steiner_pos_batch([tree], [flows], flow_exp)[0]
+    elif method != 'cvxpy':
+        raise ValueError('unknown method: %s' % method)
 
     nodes = sorted(tree.get_nodes())
     arcs = sorted(tree.get_arcs())
 
-    # create variables for 2d-positions
-    x = {n:cvx.Variable(2) for n in nodes}
-    
-    # fix positions of terminals
-    fixed_pos = [x[n] == np.array(tree.dg.node[n]['pos'])
-                 for n in nodes
-                 if tree.is_terminal(n)]
-
-    constraints = fixed_pos
-    
-    obj = sum(flows[u,v]**flow_exp * cvx.norm2(x[u] - x[v]) for u,v in arcs)
-    prob = cvx.Problem(cvx.Minimize(obj), constraints)
+    build = _build_vectorized if vectorized else _build_loops
+    prob, x = build(tree, nodes, arcs, flows, flow_exp)
 
-    opt = prob.solve(solver=cvx.CVXOPT, verbose=verbose)
-    sol = {n:np.array(x[n].value)[:, 0].tolist() for n in nodes}
+    opt = prob.solve(solver=solver, verbose=verbose)
+    sol = {n:np.asarray(x[n].value).ravel().tolist() for n in nodes}
     return sol
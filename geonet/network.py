@@ -3,6 +3,7 @@ Data structures for (Steiner) tree networks
 '''
 
 import networkx as nx
+import numpy as np
 
 class Net(object):
     '''Network'''
@@ -121,6 +122,140 @@ class SteinerTree(Net):
             other.get_terminal_positions() == self.get_terminal_positions()
 
 
+class CompactTree(object):
+    '''Steiner tree stored in flat arrays
+
+    Nodes are referred to by their index into ids. Arcs are rows of
+    (tail, head) indices, terminals are marked in a boolean mask and
+    their positions are rows in pos (NaN for Steiner nodes).
+
+    Implements the read-only API of SteinerTree, but without building
+    a networkx graph.
+    '''
+
+    def __init__(self, ids, arcs, terminal, pos):
+        '''
+        ids: node IDs, in index order
+        arcs: (m, 2) array of node indices (tail, head)
+        terminal: (n,) boolean mask of terminal nodes
+        pos: (n, 2) array of node positions
+        '''
+        self.ids = ids
+        self.arcs = np.asarray(arcs, dtype=np.int32).reshape(-1, 2)
+        self.terminal = np.asarray(terminal, dtype=bool).reshape(-1)
+        self.pos = np.asarray(pos, dtype=np.float64).reshape(-1, 2)
+        assert len(self.ids) == len(self.terminal) == len(self.pos)
+        self._index = None
+
+    @classmethod
+    def from_steiner_tree(cls, tree):
+        '''build compact copy of a SteinerTree'''
+        ids = list(tree.get_nodes())
+        index = {n:i for i, n in enumerate(ids)}
+        arcs = [(index[u], index[v]) for u, v in tree.get_arcs()]
+        terminal = [tree.is_terminal(n) for n in ids]
+        pos = [tree.get_position(n) if t else (np.nan, np.nan)
+               for n, t in zip(ids, terminal)]
+        return cls(ids, arcs, terminal, pos)
+
+    def to_steiner_tree(self):
+        '''build equivalent SteinerTree (positions become float tuples)'''
+        return SteinerTree(self.get_nodes(), self.get_arcs(),
+                           self.get_terminal_positions())
+
+    def index(self, n):
+        '''index of node with ID n'''
+        if self._index is None:
+            self._index = {m:i for i, m in enumerate(self.ids)}
+        return self._index[n]
+
+    def get_nodes(self):
+        return list(self.ids)
+
+    def get_arcs(self):
+        ids = self.ids
+        return [(ids[u], ids[v]) for u, v in self.arcs.tolist()]
+
+    def get_degrees(self):
+        '''array of node degrees, in index order'''
+        return np.bincount(self.arcs.ravel(), minlength=len(self.ids))
+
+    def get_degree(self, n):
+        i = self.index(n)
+        return int(np.count_nonzero(self.arcs == i))
+
+    def get_neighbors(self, n):
+        i = self.index(n)
+        arcs = self.arcs
+        nbrs = np.concatenate([arcs[arcs[:, 1] == i, 0],
+                               arcs[arcs[:, 0] == i, 1]])
+        return [self.ids[j] for j in nbrs.tolist()]
+
+    def is_steiner(self, n):
+        return not self.is_terminal(n)
+
+    def is_terminal(self, n):
+        return bool(self.terminal[self.index(n)])
+
+    def get_terminal_nodes(self):
+        return [self.ids[i] for i in np.flatnonzero(self.terminal).tolist()]
+
+    def get_steiner_nodes(self):
+        return [self.ids[i] for i in np.flatnonzero(~self.terminal).tolist()]
+
+    def get_position(self, t):
+        if not self.is_terminal(t):
+            raise KeyError("Not a terminal: %s" % t)
+        return tuple(self.pos[self.index(t)].tolist())
+
+    def get_terminal_positions(self):
+        idx = np.flatnonzero(self.terminal).tolist()
+        return {self.ids[i]: tuple(self.pos[i].tolist()) for i in idx}
+
+    def is_full_steiner_topology(self):
+        '''or is the tree degenerate?
+
+        same criteria as SteinerTree.is_full_steiner_topology
+        '''
+        nterms = np.count_nonzero(self.terminal)
+        nsteins = len(self.terminal) - nterms
+
+        # special cases for n < 3
+        if nterms < 3 and nsteins == 0:
+            return True
+        # general case
+        if nsteins != nterms - 2:
+            return False
+        deg = self.get_degrees()
+        if np.any(deg[~self.terminal] != 3):
+            return False
+        if np.any(deg[self.terminal] != 1):
+            return False
+        # no arc may connect two terminals
+        tt = self.terminal[self.arcs]
+        return not np.any(tt[:, 0] & tt[:, 1])
+
+    def __repr__(self):
+        _nodes = ', '.join([repr(n) for n in self.get_nodes()])
+        _arcs = ', '.join([repr(a) for a in self.get_arcs()])
+        _pos = ', '.join('%s:%s' % (t, self.get_position(t))
+                         for t in self.get_terminal_nodes())
+        return 'CompactTree([%s], [%s], {%s})' % (_nodes, _arcs, _pos)
+
+    def __eq__(self, other):
+        if isinstance(other, self.__class__):
+            return all([
+                set(other.get_nodes()) == set(self.get_nodes()),
+                set(other.get_arcs()) == set(self.get_arcs()),
+                other.get_terminal_positions() == self.get_terminal_positions(),
+            ])
+        else:
+            return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
 def merge_pos(tree, steiner_pos):
     '''build dict as union from terminal and steiner positions'''
     pos = dict(tree.get_terminal_positions())
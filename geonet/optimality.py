@@ -0,0 +1,142 @@
+'''
+Classify solutions as (locally) optimal Steiner trees or degenerate.
+
+In a Steiner minimal tree, every Steiner node has three edges meeting
+at angles of 120 degrees. Solutions of a full Steiner topology can also
+be degenerate, with zero-length edges or Steiner nodes collapsed onto
+terminals.
+'''
+
+from collections import namedtuple
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from geonet.network import merge_pos
+from geonet.geometry import position_array, arc_index_array, arc_lengths, \
+    all_star_angles
+from geonet.constants import abstol
+
+Report = namedtuple('Report', ['angle_violations', 'collapsed', 'zero_edges',
+                               'optimal'])
+
+
+def _classify(P, arcs, steiner, group, abstol, angtol):
+    '''classify nodes and arcs of one or more (disjoint) trees
+
+    args:
+    - P: (n, 2) array of node positions
+    - arcs: (m, 2) array of node indices
+    - steiner: (n,) boolean mask of Steiner nodes
+    - group: (n,) array of tree numbers of nodes
+
+    returns:
+    - (m,) boolean mask of zero-length arcs
+    - (n,) boolean mask of Steiner nodes violating the angle condition
+    - (k, 2) array of Steiner and terminal nodes at the same position
+    '''
+    n = len(P)
+    ends = arcs.ravel()
+
+    # zero-length edges, at least one end node is Steiner
+    steiner_arc = steiner[arcs[:, 0]] | steiner[arcs[:, 1]]
+    zero = steiner_arc & (arc_lengths(P, arcs) <= abstol)
+    touched = np.zeros(n, dtype=bool)
+    touched[arcs[zero].ravel()] = True
+
+    # three edges at 120 degrees for other Steiner nodes
+    degree = np.bincount(ends, minlength=n)
+    violation = steiner & ~touched & (degree != 3)
+    check = np.flatnonzero(steiner & ~touched & (degree == 3))
+    centers, angles = all_star_angles(P, arcs, check)
+    bad = np.abs(angles - 2*np.pi/3) > angtol
+    violation[centers[bad]] = True
+
+    # Steiner nodes on terminals; trees are separated along a third axis
+    S, T = np.flatnonzero(steiner), np.flatnonzero(~steiner)
+    collapsed = np.zeros((0, 2), dtype=int)
+    if len(S) and len(T):
+        Q = np.column_stack([P, 10 * abstol * group])
+        pairs = cKDTree(Q[S]).sparse_distance_matrix(
+            cKDTree(Q[T]), abstol, output_type='ndarray')
+        collapsed = np.column_stack([S[pairs['i']], T[pairs['j']]])
+        collapsed = collapsed[np.lexsort(collapsed.T[::-1])]
+
+    return zero, violation, collapsed
+
+
+def _tree_arrays(tree, steiner_pos):
+    '''nodes, arcs, position array, arc index array and Steiner mask'''
+    pos = merge_pos(tree, steiner_pos)
+    nodes, arcs = tree.get_nodes(), tree.get_arcs()
+    steiner = np.array([tree.is_steiner(n) for n in nodes], dtype=bool)
+    return (nodes, arcs, position_array(nodes, pos),
+            arc_index_array(nodes, arcs), steiner)
+
+
+def _report(nodes, arcs, zero, violation, collapsed):
+    angle_violations = [nodes[i] for i in np.flatnonzero(violation)]
+    collapsed = [(nodes[s], nodes[t]) for s, t in collapsed]
+    zero_edges = [arcs[i] for i in np.flatnonzero(zero)]
+    optimal = not (angle_violations or collapsed or zero_edges)
+    return Report(angle_violations, collapsed, zero_edges, optimal)
+
+
+def classify(tree, steiner_pos, abstol=abstol, angtol=1e-3):
+    '''check angle condition and degeneracy of a solution
+
+    args:
+    - tree: Steiner tree
+    - steiner_pos: positions of Steiner nodes
+    - abstol: absolute tolerance for distances
+    - angtol: tolerance for angles (in radians)
+
+    returns Report with
+    - angle_violations: Steiner nodes without three edges at 120 degrees
+                        (unless they have a zero-length edge)
+    - collapsed: pairs of Steiner node and terminal at the same position
+    - zero_edges: edges with (numerically) zero length
+    - optimal: whether all of the above are empty
+    '''
+    nodes, arcs, P, A, steiner = _tree_arrays(tree, steiner_pos)
+    group = np.zeros(len(nodes))
+    zero, violation, collapsed = _classify(P, A, steiner, group,
+                                           abstol, angtol)
+    return _report(nodes, arcs, zero, violation, collapsed)
+
+
+def classify_all(solutions, abstol=abstol, angtol=1e-3):
+    '''classify many solutions at once, see classify
+
+    All trees are stacked into one disjoint forest, which is checked in
+    a single vectorized pass.
+
+    args:
+    - solutions: list of objects with tree and steiner_pos attributes
+                 (e.g. optimization.Solution)
+
+    returns list of Report, in order of solutions
+    '''
+    data = [_tree_arrays(s.tree, s.steiner_pos) for s in solutions]
+    if not data:
+        return []
+    sizes = np.array([len(d[0]) for d in data])
+    offsets = np.r_[0, np.cumsum(sizes)[:-1]]
+
+    P = np.concatenate([d[2] for d in data])
+    A = np.concatenate([d[3] + o for d, o in zip(data, offsets)])
+    steiner = np.concatenate([d[4] for d in data])
+    group = np.repeat(np.arange(len(data)), sizes)
+    zero, violation, collapsed = _classify(P, A, steiner, group,
+                                           abstol, angtol)
+
+    # split results by tree
+    arc_splits = np.cumsum([len(d[1]) for d in data])[:-1]
+    node_splits = np.cumsum(sizes)[:-1]
+    coll_splits = np.searchsorted(collapsed[:, 0], node_splits)
+    reports = []
+    for d, o, z, v, c in zip(data, offsets, np.split(zero, arc_splits),
+                             np.split(violation, node_splits),
+                             np.split(collapsed, coll_splits)):
+        reports.append(_report(d[0], d[1], z, v, c - o))
+    return reports
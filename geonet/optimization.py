@@ -2,12 +2,19 @@
 Optimization methods for the layout of pipeline networks.
 '''
 
-from collections import namedtuple
+from collections import namedtuple, deque
+import cPickle as pickle
+from heapq import heappush, heapreplace
+from itertools import islice
+from multiprocessing import Pool
+import os
 
-from geonet.network import SteinerTree
+from geonet.network import SteinerTree, CompactTree
+from geonet.geometry import distance
 import geonet.isomorph
 import geonet.flow
 import geonet.junction_loc
+import geonet.mintrans
 
 Instance = namedtuple('Instance', ['term_pos', 'demand', 'diams', 'costs',
                                    'pres_min', 'pres_max', 'C'])
@@ -16,26 +23,272 @@ Instance = namedtuple('Instance', ['term_pos', 'demand', 'diams', 'costs',
 Solution = namedtuple('Solution', ['tree', 'steiner_pos', 'obj'])
 
 
-def enum_fsts(instance):
-    '''Find best network by enumeration of all FST topologies.
+def solve_topology(instance, tree, **options):
+    '''Find optimal Steiner node positions for a given topology.
 
-    Returns all solutions, sorted by increasing cost.
+    options are passed to junction_loc.steiner_pos.
     '''
+    # determine arc flow and orientation
+    flow = geonet.flow.find_tree_flow(tree, instance.demand)
+    tree, flow = geonet.flow.make_forward_flow(tree, flow)
+
+    # find optimal Steiner node positions
+    pos, obj = geonet.junction_loc.steiner_pos(
+        tree, flow, instance.diams, instance.costs,
+        [instance.pres_min, instance.pres_max], instance.C, **options)
+
+    return Solution(tree, pos, obj)
+
+
+def _terminal_pairs(tree):
+    '''pairs of terminals connected by edge-disjoint paths in tree'''
+    terms = tree.get_terminal_nodes()
+    if len(terms) < 2:
+        return []
+    root = min(terms)
+
+    # DFS from root, each subtree passes up at most one unpaired terminal
+    pairs = []
+    unpaired = {}
+    parent = {root: None}
+    stack = [root]
+    order = []
+    while stack:
+        n = stack.pop()
+        order.append(n)
+        for m in tree.get_neighbors(n):
+            if m not in parent:
+                parent[m] = n
+                stack.append(m)
+    for n in reversed(order):
+        up = [unpaired[m] for m in tree.get_neighbors(n)
+              if parent.get(m) == n and unpaired[m] is not None]
+        if tree.is_terminal(n):
+            up.append(n)
+        while len(up) >= 2:
+            pairs.append((up.pop(), up.pop()))
+        unpaired[n] = up[0] if up else None
+    return pairs
+
+
+def lower_bound(instance, tree, method='terminal'):
+    '''Cheap lower bound on the cost of a topology.
+
+    Each arc costs at least its length times the cost of the smallest
+    diameter, so any lower bound on the length of the tree works:
+    - terminal : distances of terminal pairs joined by edge-disjoint
+                 paths in the topology
+    - length   : minimal length of the topology, from mintrans
+    '''
+    if method == 'terminal':
+        term_pos = tree.get_terminal_positions()
+        length = sum(distance(term_pos[s], term_pos[t])
+                     for s, t in _terminal_pairs(tree))
+    elif method == 'length':
+        ones = {a:1.0 for a in tree.get_arcs()}
+        pos = geonet.mintrans.steiner_pos(tree, ones, flow_exp=0.0,
+                                          method='weiszfeld')
+        length = sum(distance(pos[u], pos[v]) for u, v in tree.get_arcs())
+    else:
+        raise ValueError('Unknown bound: %s' % method)
+    return instance.costs[0] * length
+
+
+def _compact_solution(sol):
+    return sol._replace(tree=CompactTree.from_steiner_tree(sol.tree))
+
+def _expand_solution(sol):
+    return sol._replace(tree=sol.tree.to_steiner_tree())
+
+
+# instance and options shared by all topologies solved in a worker process
+_worker_instance = None
+_worker_options = None
+
+def _init_worker(instance, options):
+    global _worker_instance, _worker_options
+    _worker_instance = instance
+    _worker_options = options
+
+def _solve_compact(items):
+    '''solve_topology in worker process, with compact trees in and out'''
     sols = []
+    for index, ctree in items:
+        sol = solve_topology(_worker_instance, ctree.to_steiner_tree(),
+                             **_worker_options)
+        sols.append((index, _compact_solution(sol)))
+    return sols
+
+
+def _solve_all(instance, trees, workers, chunksize, options):
+    '''generate (index, solution) for all (index, tree), in order
+
+    With a pool, at most workers chunks are submitted at a time, and
+    the next chunk is taken from trees only after the results of the
+    oldest one were consumed. So lazy filters in trees (like pruning)
+    see an incumbent that is at most workers chunks behind.
+    '''
+    if workers == 1:
+        for index, tree in trees:
+            yield index, solve_topology(instance, tree, **options)
+    else:
+        pool = Pool(workers, _init_worker, (instance, options))
+        try:
+            trees = iter(trees)
+            pending = deque()
+            def submit():
+                chunk = [(i, CompactTree.from_steiner_tree(t))
+                         for i, t in islice(trees, chunksize)]
+                if chunk:
+                    pending.append(pool.apply_async(_solve_compact, (chunk,)))
+                return bool(chunk)
+
+            while len(pending) < workers and submit():
+                pass
+            while pending:
+                for i, s in pending.popleft().get():
+                    yield i, _expand_solution(s)
+                submit()
+        finally:
+            pool.terminate()
+
+
+def _write_checkpoint(path, instance, state):
+    '''atomically replace checkpoint file with current state'''
+    state = dict(state)
+    if state['top_k'] is None:
+        state['sols'] = [_compact_solution(s) for s in state['sols']]
+    else:
+        state['sols'] = [(o, i, _compact_solution(s))
+                         for o, i, s in state['sols']]
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump((instance, state), f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp, path)
+
+def _read_checkpoint(path):
+    with open(path, 'rb') as f:
+        instance, state = pickle.load(f)
+    if state['top_k'] is None:
+        state['sols'] = [_expand_solution(s) for s in state['sols']]
+    else:
+        state['sols'] = [(o, i, _expand_solution(s))
+                         for o, i, s in state['sols']]
+    return instance, state
+
+
+def _solve_options(template, solver):
+    '''keyword arguments for junction_loc.steiner_pos'''
+    options = {'template': template}
+    if solver is not None:
+        options['solver'] = solver
+    return options
+
+
+def _enum_fsts(instance, state, workers, chunksize, checkpoint,
+               checkpoint_every, stats, options):
+    '''continue enumeration from state, see enum_fsts'''
+    prune, top_k = state['prune'], state['top_k']
+
+    def candidates():
+        # enumerate all FST topologies (from cursor), labels are not used
+        trees = geonet.isomorph.iter_enum_orderly(instance.term_pos,
+                                                  start=state['cursor'],
+                                                  label=lambda tree: None)
+        for index, (_, tree) in enumerate(trees, state['cursor']):
+            if prune is not None and state['incumbent'] is not None and \
+               lower_bound(instance, tree, prune) > state['incumbent']:
+                continue
+            yield index, tree
+
+    # with top_k, a heap of (-obj, -index, solution), worst on top
+    sols = state['sols']
+    solutions = _solve_all(instance, candidates(), workers, chunksize,
+                           options)
+    for index, sol in solutions:
+        state['solved'] += 1
+        if top_k is None:
+            sols.append(sol)
+            if sol.obj is not None and \
+               (state['incumbent'] is None or sol.obj < state['incumbent']):
+                state['incumbent'] = sol.obj
+        elif sol.obj is not None:
+            item = (-sol.obj, -index, sol)
+            if len(sols) < top_k:
+                heappush(sols, item)
+            elif item > sols[0]:
+                heapreplace(sols, item)
+            if len(sols) == top_k:
+                state['incumbent'] = -sols[0][0]
 
-    # enumerate all FST topologies
-    trees = geonet.isomorph.enum(instance.term_pos)
-    for label, tree in trees.iteritems():
-        # determine arc flow and orientation
-        flow = geonet.flow.find_arc_flow(tree, instance.demand)
-        tree, flow = geonet.flow.make_forward_flow(tree, flow)
+        # all topologies before cursor are done (solved or pruned)
+        state['cursor'] = index + 1
+        if checkpoint is not None and \
+           state['solved'] % checkpoint_every == 0:
+            _write_checkpoint(checkpoint, instance, state)
 
-        # find optimal Steiner node positions
-        pos, obj = geonet.junction_loc.steiner_pos(
-            tree, flow, instance.diams, instance.costs,
-            [instance.pres_min, instance.pres_max], instance.C)
+    state['cursor'] = geonet.isomorph.count_fsts(len(instance.term_pos))
+    if checkpoint is not None:
+        _write_checkpoint(checkpoint, instance, state)
 
-        sols.append(Solution(tree, pos, obj))
+    if stats is not None:
+        stats.update(topologies=state['cursor'],
+                     pruned=state['cursor'] - state['solved'])
 
+    if top_k is not None:
+        sols = [sol for _, _, sol in sols]
+    else:
+        sols = list(sols)
     sols.sort(key=lambda s: s.obj)
     return sols
+
+
+def enum_fsts(instance, workers=1, chunksize=1, prune=None, top_k=None,
+              stats=None, checkpoint=None, checkpoint_every=100,
+              template=False, solver=None):
+    '''Find best network by enumeration of all FST topologies.
+
+    args:
+    - instance         : problem Instance
+    - workers          : number of processes solving topologies in parallel
+    - chunksize        : number of topologies sent to a worker at once
+    - prune            : method of lower_bound, to skip topologies that
+                         can not improve on the incumbent
+    - top_k            : keep only the k best solutions (and use the k-th
+                         best as incumbent for pruning)
+    - stats            : optional dict, filled with the number of
+                         'topologies' and of 'pruned' topologies
+    - checkpoint       : path of file to save progress to, see resume_fsts
+    - checkpoint_every : number of solved topologies between saves
+    - template         : solve all topologies with the same parametrized
+                         model (see junction_loc.SteinerPosTemplate)
+    - solver           : cvxpy solver for junction_loc.steiner_pos
+
+    Returns all (or the top_k) solutions, sorted by increasing cost.
+    Pruned topologies are missing.
+    '''
+    state = {
+        'cursor': 0,        # index of next topology in iter_enum_orderly
+        'solved': 0,        # number of topologies solved before cursor
+        'sols': [],         # solutions so far (heap with top_k)
+        'incumbent': None,  # objective value used for pruning
+        'prune': prune,
+        'top_k': top_k,
+    }
+    options = _solve_options(template, solver)
+    return _enum_fsts(instance, state, workers, chunksize, checkpoint,
+                      checkpoint_every, stats, options)
+
+
+def resume_fsts(checkpoint, workers=1, chunksize=1, stats=None,
+                checkpoint_every=100, template=False, solver=None):
+    '''Continue enum_fsts from the last save in the checkpoint file.
+
+    Topologies solved before the save are not solved again. The instance
+    and the prune and top_k options are taken from the checkpoint, which
+    is updated while enumeration continues.
+    '''
+    instance, state = _read_checkpoint(checkpoint)
+    options = _solve_options(template, solver)
+    return _enum_fsts(instance, state, workers, chunksize, checkpoint,
+                      checkpoint_every, stats, options)
@@ -12,6 +12,7 @@ from matplotlib.colors import Normalize
 import numpy as np
 
 from geonet.network import SteinerTree, merge_pos
+from geonet.geometry import position_array, arc_index_array
 from geonet.constants import diam_min, diam_max
 
 _diam_cmap = plt.cm.YlGnBu
@@ -34,8 +35,7 @@ def draw_nodes(nodes, pos, demand=None, fig=None, ax=None):
     if demand is None:
         demand = dict((n,0) for n in nodes)
 
-    x = np.array([pos[n][0] for n in nodes])
-    y = np.array([pos[n][1] for n in nodes])
+    x, y = position_array(nodes, pos).T
     d = np.array([demand.get(n, 0) for n in nodes])
 
     # color should be red for entries, blue for exits, white for Steiner
@@ -59,10 +59,7 @@ def draw_edges(tree, steiner_pos, diams=None, fig=None, ax=None, lim=None,
     pos = merge_pos(tree, steiner_pos)
     nodes = tree.get_nodes()
     arcs = tree.get_arcs()
-    x = np.array([pos[n][0] for n in nodes])
-    y = np.array([pos[n][1] for n in nodes])
-
-    segments = [(pos[u], pos[v]) for (u,v) in arcs]
+    segments = position_array(nodes, pos)[arc_index_array(nodes, arcs)]
 
     if diams is None:
         lines = LineCollection(segments, colors='k', zorder=1)
@@ -1,7 +1,12 @@
+import math
+import random
+
+import numpy as np
 import py.test
 
 from geonet.network import SteinerTree
-from geonet.crossing import crossing_edges
+from geonet.crossing import crossing_edges, has_crossing, segment_crossings, \
+    _grid_candidates, _segments
 
 def test_no_crossings():
     no_edge = SteinerTree('a', [], {'a':(0, 0)})
@@ -16,6 +21,7 @@ def test_no_crossings():
     star = SteinerTree('abcs', ['as', 'bs', 'cs'],
                        {'a':(0, 0), 'b':(2, 0), 'c':(0, 2)})
     assert crossing_edges(star, {'s': (1, 1)}) == []
+    assert not has_crossing(star, {'s': (1, 1)})
 
 def test_crossings():
     pair = SteinerTree('abcd', ['ab', 'cd'],
@@ -23,6 +29,7 @@ def test_crossings():
     edges = crossing_edges(pair, {})
     assert len(edges) == 1
     assert set(edges[0]) == set([('a', 'b'), ('c', 'd')])
+    assert has_crossing(pair, {})
 
     path = SteinerTree('abcde', ['ab', 'bc', 'cd', 'de'],
                        {'a': (1, 0), 'b': (1, 1), 'c': (2, 0), 'e': (0, 0)})
@@ -32,3 +39,69 @@ def test_crossings():
         assert ('d', 'e') in p
         assert ('a', 'b') in p or ('b', 'c') in p
     assert edges[0] != edges[1]
+
+def test_grid():
+    '''grid buckets find the same crossings as comparing all pairs'''
+    rand = random.Random(0)
+    pos, arcs = {}, []
+    for i in range(150):
+        x, y = rand.uniform(0, 100), rand.uniform(0, 100)
+        a, l = rand.uniform(0, 2*math.pi), rand.expovariate(0.2)
+        pos['u%d' % i] = (x, y)
+        pos['v%d' % i] = (x + l*math.cos(a), y + l*math.sin(a))
+        arcs.append(('u%d' % i, 'v%d' % i))
+    # some long edges, an edge touching another and a degenerate one
+    pos.update({'p': (0, 0), 'q': (100, 100), 'r': (0, 100), 's': (100, 0),
+                'x': (50, 50), 'y': (50, 50)})
+    arcs += [('p', 'q'), ('r', 's'), ('x', 'y'), ('u0', 'x')]
+    forest = SteinerTree(sorted(pos), arcs, pos)
+
+    edges = crossing_edges(forest, {})
+    assert edges == crossing_edges(forest, {}, method='pairs')
+    assert (('p', 'q'), ('r', 's')) in edges
+    assert len(edges) > 10
+
+    with py.test.raises(ValueError):
+        crossing_edges(forest, {}, method='sweep')
+
+def test_grid_long_segment():
+    '''a long segment among tiny ones is not put into many cells'''
+    rand = random.Random(1)
+    pos, arcs = {'p': (0, 0), 'q': (100, 100)}, [('p', 'q')]
+    for i in range(1000):
+        x = rand.uniform(0, 100)
+        y = x + rand.choice([-1, 1]) * rand.uniform(0, 1e-3)
+        pos['u%d' % i] = (x - 1e-3, y)
+        pos['v%d' % i] = (x + 1e-3, 2*x - y)
+        arcs.append(('u%d' % i, 'v%d' % i))
+    forest = SteinerTree(sorted(pos), arcs, pos)
+
+    edges = crossing_edges(forest, {})
+    assert edges == crossing_edges(forest, {}, method='pairs')
+    assert len(edges) > 100
+
+    # pairs of the long segment with all others, and a few more
+    _, segs, _ = _segments(forest, {})
+    assert len(_grid_candidates(segs)) < 2 * len(segs)
+
+def test_segment_crossings():
+    '''tolerance rules of the batched kernel'''
+    segs = np.array([[(0, 0), (2, 0)],     # 0: base segment
+                     [(1, -1), (1, 1)],    # 1: crosses 0
+                     [(1, 0), (1, 1)],     # 2: touches 0 in its end point
+                     [(0, 1), (2, 1)],     # 3: parallel to 0
+                     [(1, -1), (1, -1)],   # 4: degenerate
+                     [(2, 0), (1, 2)],     # 5: adjacent to 0 (node 1)
+                     [(1, -1e-5), (1, 1)]]) # 6: ends near 0
+    ends = [(0, 1), (2, 3), (4, 5), (6, 7), (8, 9), (1, 10), (11, 12)]
+    pairs = [(0, j) for j in range(1, 7)]
+
+    mask = segment_crossings(segs, pairs, ends)
+    assert mask.tolist() == [True, False, False, False, False, False]
+
+    # smaller tolerance: segment 6 now crosses
+    mask = segment_crossings(segs, pairs, ends, abstol=1e-6)
+    assert mask.tolist() == [True, False, False, False, False, True]
+
+    # without node indices, only the shared end point counts
+    assert not segment_crossings(segs, [(0, 5)])[0]
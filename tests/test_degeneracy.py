@@ -1,7 +1,8 @@
 import pytest
 
 from geonet.network import SteinerTree
-from geonet.degeneracy import degenerate_edges, is_degenerate, merged
+from geonet.degeneracy import degenerate_edges, is_degenerate, merged, \
+    coincident_nodes
 
 @pytest.mark.parametrize("term_pos", [
     {'a':(0,0), 'b':(0,0), 'c':(0,0)},
@@ -78,3 +79,48 @@ def test_merged_multi():
         set([('b', 'a'), ('a', 'c'), ('a', 'd')])
     assert mpos != pos
     assert mpos == {}
+
+
+def test_merged_terminals():
+    '''groups of degenerate edges keep one terminal each'''
+    tree = SteinerTree('abcstu', ['as', 'st', 'tb', 'tu', 'uc'],
+                       {'a': (0,0), 'b':(0,0), 'c':(2,0)})
+    pos = {'s':(0,0), 't':(0,0), 'u':(1,0)}
+
+    mtree, mpos = merged(tree, pos)
+    assert set(mtree.get_nodes()) == set('abcu')
+    assert set(mtree.get_arcs()) == set([('a', 'b'), ('a', 'u'), ('u', 'c')])
+    assert mpos == {'u':(1,0)}
+
+
+def test_coincident():
+    '''non-adjacent nodes at the same position'''
+    tree = SteinerTree('abcdst', ['as', 'bs', 'st', 'tc', 'td'],
+                       {'a': (0,0), 'b':(0,2), 'c':(2,2), 'd':(2,0)})
+    pos = {'s':(1,1), 't':(2,0)}
+
+    assert coincident_nodes(tree, pos) == []
+    assert coincident_nodes(tree, {'s':(1,1), 't':(1,1)}) == []
+
+    # s at terminal d, which is not its neighbor
+    pos = {'s':(2,0), 't':(1.5,0.5)}
+    assert coincident_nodes(tree, pos) == [('d', 's')]
+    assert not is_degenerate(tree, pos)
+
+    mtree, mpos = merged(tree, pos)
+    assert mtree == tree
+    mtree, mpos = merged(tree, pos, coincident=True)
+    assert set(mtree.get_nodes()) == set('abcdt')
+    assert set(mtree.get_arcs()) == \
+        set([('a', 'd'), ('b', 'd'), ('d', 't'), ('t', 'c')])
+    assert mpos == {'t':(1.5,0.5)}
+
+    # s at terminal d, three arcs away: the cycle d-t-u remains
+    tree = SteinerTree('abcdestu', ['as', 'bs', 'st', 'tc', 'tu', 'ud', 'ue'],
+                       {'a': (0,0), 'b':(0,2), 'c':(2,2), 'd':(4,0),
+                        'e':(4,2)})
+    pos = {'s':(4,0), 't':(2,1), 'u':(3,1)}
+    mtree, mpos = merged(tree, pos, coincident=True)
+    assert set(mtree.get_arcs()) == \
+        set([('a', 'd'), ('b', 'd'), ('d', 't'), ('t', 'c'), ('t', 'u'),
+             ('u', 'd'), ('u', 'e')])
@@ -1,8 +1,9 @@
 import pytest
 
 from geonet.network import SteinerTree
-from geonet.flow import find_arc_flow
-from geonet.diameter import solve
+from geonet.flow import find_arc_flow, tree_flow_matrix, find_arc_flows
+import geonet.diameter
+from geonet.diameter import solve, solve_scenarios
 
 TOL = 1e-5
 
@@ -19,7 +20,8 @@ def test_solve():
 
     flow = find_arc_flow(tree, demand)
 
-    ds, ps, obj = solve(tree, flow, steiner_pos, diams, costs, pres, C)
+    ds, ps, obj = solve(tree, flow, steiner_pos, diams, costs, pres, C,
+                        method='cvxpy')
     assert obj is not None
 
     for n, p in ps.items():
@@ -29,3 +31,164 @@ def test_solve():
     for a, d in ds.items():
         assert d >= min(diams) - TOL
         assert d <= max(diams) + TOL
+
+
+@pytest.mark.parametrize("options", [
+    {'method': 'cvxpy'},
+    {'method': 'cvxpy', 'vectorized': False},
+    {'method': 'cvxpy', 'solver': 'ECOS'},
+    {'vectorized': False},
+    {'method': 'linprog'},
+])
+def test_formulations(options, monkeypatch):
+    '''Matrix and loop models and the linprog backend agree with tree'''
+    tree = SteinerTree('abcs', ['as', 'bs', 'cs'],
+                       {'a':(0,0), 'b':(10,0), 'c':(0,10)})
+    demand = {'a':-30, 'b':20, 'c':10}
+    diams = [0.4, 0.6, 0.8, 1., 1.2]
+    costs = [680., 910., 1200., 1550., 1960.]
+    pres = [40, 80]
+    steiner_pos = {'s':(5, 5)}
+    flow = find_arc_flow(tree, demand)
+
+    ds, ps, obj = solve(tree, flow, steiner_pos, diams, costs, pres,
+                        method='tree')
+
+    # the LP is solved, even with method 'auto'
+    def no_tree(*args):
+        raise AssertionError('solved on tree')
+    monkeypatch.setattr(geonet.diameter, '_solve_tree', no_tree)
+    ods, ops, oobj = solve(tree, flow, steiner_pos, diams, costs, pres,
+                           **options)
+    assert oobj == pytest.approx(obj, rel=1e-5)
+    assert set(ods) == set(ds)
+    for a in ds:
+        assert ods[a] == pytest.approx(ds[a], rel=1e-3)
+    for n in ps:
+        assert ps[n] >= min(pres) - TOL and ops[n] >= min(pres) - TOL
+        assert ps[n] <= max(pres) + TOL and ops[n] <= max(pres) + TOL
+
+    with pytest.raises(ValueError):
+        solve(tree, flow, steiner_pos, diams, costs, pres, method='simplex')
+
+
+def test_linprog_scaling():
+    '''linprog solves instances with a wide pressure range'''
+    tree = SteinerTree('abcs', ['as', 'bs', 'cs'],
+                       {'a':(21,97), 'b':(44,63), 'c':(30,51)})
+    demand = {'a':-20, 'b':8, 'c':12}
+    diams = [0.4, 0.6, 0.8, 1., 1.2]
+    costs = [680., 910., 1200., 1550., 1960.]
+    pres = [40, 150]
+    steiner_pos = {'s':(58.4, 90.4)}
+    flow = find_arc_flow(tree, demand)
+
+    _, _, obj = solve(tree, flow, steiner_pos, diams, costs, pres,
+                      method='tree')
+    ds, ps, lobj = solve(tree, flow, steiner_pos, diams, costs, pres,
+                         method='linprog')
+    assert lobj == pytest.approx(obj, rel=1e-5)
+    for n, p in ps.items():
+        assert min(pres) - TOL <= p <= max(pres) + TOL
+
+
+@pytest.mark.parametrize("method", ['cvxpy', 'linprog'])
+def test_solve_scenarios(method):
+    '''Batch of scenarios, independent and robust'''
+    tree = SteinerTree('abcs', ['as', 'bs', 'cs'],
+                       {'a':(0,0), 'b':(10,0), 'c':(0,10)})
+    diams = [0.4, 0.6, 0.8, 1., 1.2]
+    costs = [680., 910., 1200., 1550., 1960.]
+    steiner_pos = {'s':(5, 5)}
+    tf = tree_flow_matrix(tree)
+    demands = [{'a':-30, 'b':20, 'c':10},
+               {'a':-20, 'b':5, 'c':15},
+               {'a':10, 'b':-20, 'c':10},
+               {'a':-90, 'b':45, 'c':45}]
+    flows = find_arc_flows(tree, [[d.get(n, 0) for n in tf.nodes]
+                                  for d in demands], tf)
+    pres = [(40, 80), (40, 80), (50, 80), (40, 80)]
+
+    ds, ps, objs = solve_scenarios(tree, flows, steiner_pos, diams, costs,
+                                   pres, arcs=tf.arcs, method=method)
+    for k in range(3):
+        d, p, obj = solve(tree, find_arc_flow(tree, demands[k]), steiner_pos,
+                          diams, costs, pres[k], method='linprog')
+        assert objs[k] == pytest.approx(obj, rel=1e-4)
+        for n in p:
+            assert ps[k][n] >= min(pres[k]) - TOL
+            assert ps[k][n] <= max(pres[k]) + TOL
+
+    # last scenario is infeasible, the others are still solved
+    assert ds[3] is None and ps[3] is None and objs[3] is None
+
+    # robust diameters cost more, but work for all scenarios
+    ds, ps, robs = solve_scenarios(tree, flows[:3], steiner_pos, diams,
+                                   costs, pres[:3], arcs=tf.arcs, robust=True,
+                                   method=method)
+    assert robs[0] >= max(objs[:3]) - TOL
+    assert all(o == robs[0] for o in robs)
+    assert all(d == ds[0] for d in ds)
+    for k in range(3):
+        for n in ps[k]:
+            assert ps[k][n] >= min(pres[k]) - TOL
+            assert ps[k][n] <= max(pres[k]) + TOL
+
+
+def test_solve_tree():
+    '''Exact solution for single source agrees with LP'''
+    tree = SteinerTree('abcdst', ['as', 'bs', 'st', 'tc', 'td'],
+                       {'a': (0,0), 'b':(0,20), 'c':(30,20), 'd':(30,0)})
+    demand = {'a':-40, 'b':10, 'c':20, 'd':10}
+    diams = [0.4, 0.6, 0.8, 1., 1.2]
+    costs = [680., 910., 1200., 1550., 1960.]
+    steiner_pos = {'s':(5, 10), 't':(25, 10)}
+    flow = find_arc_flow(tree, demand)
+
+    for pres, C in [((40, 80), 0.1), ((60, 80), 0.1), ((40, 80), 0.01)]:
+        ds, ps, obj = solve(tree, flow, steiner_pos, diams, costs, pres, C,
+                            method='tree')
+        lds, lps, lobj = solve(tree, flow, steiner_pos, diams, costs, pres, C,
+                               method='cvxpy', solver='ECOS')
+        assert obj == pytest.approx(lobj, rel=1e-6)
+        for a in ds:
+            assert ds[a] == pytest.approx(lds[a], rel=1e-4)
+        for n in ps:
+            assert ps[n] >= min(pres) - TOL
+            assert ps[n] <= max(pres) + TOL
+
+    # pressure range too small
+    assert solve(tree, flow, steiner_pos, diams, costs, (75, 80), 0.1,
+                 method='tree') == (None, None, None)
+
+    # multiple sources need the LP
+    demand = {'a':-20, 'b':10, 'c':20, 'd':-10}
+    flow = find_arc_flow(tree, demand)
+    with pytest.raises(AssertionError):
+        solve(tree, flow, steiner_pos, diams, costs, (40, 80), 0.1,
+              method='tree')
+    ds, ps, obj = solve(tree, flow, steiner_pos, diams, costs, (40, 80), 0.1)
+    assert obj is not None
+
+
+@pytest.mark.parametrize("robust", [False, True])
+def test_scenarios_linprog_scaling(robust):
+    '''linprog scenarios with a wide pressure range'''
+    tree = SteinerTree('abcs', ['as', 'bs', 'cs'],
+                       {'a':(21,97), 'b':(44,63), 'c':(30,51)})
+    diams = [0.4, 0.6, 0.8, 1., 1.2]
+    costs = [680., 910., 1200., 1550., 1960.]
+    steiner_pos = {'s':(58.4, 90.4)}
+    tf = tree_flow_matrix(tree)
+    demands = [{'a':-20, 'b':8, 'c':12}, {'a':-15, 'b':10, 'c':5}]
+    flows = find_arc_flows(tree, [[d.get(n, 0) for n in tf.nodes]
+                                  for d in demands], tf)
+
+    _, _, objs = solve_scenarios(tree, flows, steiner_pos, diams, costs,
+                                 (40, 150), arcs=tf.arcs, robust=robust)
+    _, ps, lobjs = solve_scenarios(tree, flows, steiner_pos, diams, costs,
+                                   (40, 150), arcs=tf.arcs, robust=robust,
+                                   method='linprog')
+    assert lobjs == pytest.approx(objs, rel=1e-5)
+    for p in ps:
+        assert all(40 - TOL <= v <= 150 + TOL for v in p.values())
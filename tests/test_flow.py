@@ -1,7 +1,11 @@
+import numpy as np
 import pytest
+import scipy as sp
+import scipy.sparse
 
 from geonet.network import Net, SteinerTree
-from geonet.flow import find_arc_flow, make_forward_flow
+from geonet.flow import find_arc_flow, find_tree_flow, make_forward_flow, \
+    tree_flow_matrix, find_arc_flows, make_forward_flows
 
 def test_treeflow():
     '''Check that (unique) flow values are computed correctly.'''
@@ -19,6 +23,33 @@ def test_treeflow():
     assert flows['d', 'e'] == 12
     assert flows['d', 'f'] == 0
 
+def test_find_tree_flow():
+    '''Tree flow agrees with the linear solve.'''
+    nodes = 'abcdefg'
+    arcs = ['ca', 'bc', 'cd', 'ed', 'df', 'gf']
+    net = Net(nodes, arcs)
+
+    demand = {'a': -7, 'b': -5, 'e':9, 'g':3}
+
+    flows = find_tree_flow(net, demand)
+    ref = find_arc_flow(net, demand)
+    assert set(flows) == set(ref)
+    for a in ref:
+        assert abs(flows[a] - ref[a]) < 1e-9
+
+    assert flows['c', 'a'] == -7
+    assert flows['e', 'd'] == -9
+    assert flows['g', 'f'] == -3
+
+def test_find_tree_flow_path():
+    '''Flow passes through intermediate nodes, balance is checked.'''
+    net = Net('abc', ['ab', 'cb'])
+    assert find_tree_flow(net, {'a':-1, 'c':1}) == {('a','b'):1, ('c','b'):-1}
+
+    with pytest.raises(AssertionError) as e:
+        find_tree_flow(net, {'a':4})
+    assert 'flow not balanced' in str(e.value)
+
 def test_imbalance():
     '''Check exception for unbalanced data'''
     net = Net('ab', ['ab'])
@@ -48,3 +79,40 @@ def test_make_forward_flow():
     assert ('c', 's') not in new_tree.get_arcs()
 
     assert all(new_flow[a] > 0.0 for a in new_tree.get_arcs())
+
+def test_find_arc_flows():
+    '''Batched flows agree with single scenarios.'''
+    nodes = 'abcdef'
+    arcs = ['ac', 'cb', 'cd', 'de', 'fd']
+    net = Net(nodes, arcs)
+
+    scenarios = [
+        {'a': -7, 'b': 5, 'e':2},
+        {'a': -7, 'b': -5, 'e':12},
+        {'f': -3, 'a': 1, 'b': 1, 'e': 1},
+    ]
+
+    tf = tree_flow_matrix(net)
+    assert tf.nodes == sorted(nodes)
+    assert tf.arcs == sorted(net.get_arcs())
+    assert tf.matrix.shape == (6, 5)
+    assert sp.sparse.issparse(tf.matrix)
+    assert set(tf.matrix.data) == set([-1.0, 1.0])
+
+    demands = [[d.get(n, 0) for n in tf.nodes] for d in scenarios]
+    flows = find_arc_flows(net, demands, tf)
+    assert flows.shape == (3, 5)
+    for k, d in enumerate(scenarios):
+        ref = find_arc_flow(net, d)
+        for j, a in enumerate(tf.arcs):
+            assert abs(flows[k, j] - ref[a]) < 1e-9
+
+    signs, fwd = make_forward_flows(flows)
+    assert (signs * fwd == flows).all()
+    assert (fwd >= 0.0).all()
+    assert signs[1, tf.arcs.index(('c', 'b'))] == -1
+    assert signs[0, tf.arcs.index(('c', 'b'))] == 1
+
+    with pytest.raises(AssertionError) as e:
+        find_arc_flows(net, np.ones((1, 6)), tf)
+    assert 'flow not balanced' in str(e.value)
@@ -2,6 +2,7 @@ import numpy as np
 from numpy.testing import assert_allclose, assert_almost_equal
 
 from geonet.geometry import unit_vector, angle_between, star_angles, distance
+from geonet.geometry import arc_lengths, angles_between, all_star_angles
 
 def test_unit_vector():
     v1 = np.array([1, 0, 0])
@@ -49,3 +50,26 @@ def test_distance():
 
     # works with numpy arrays
     assert_almost_equal(distance(np.array([0, 1, 2]), ([0, 1, 0])), 2.0)
+
+
+def test_arc_lengths():
+    P = np.array([(0, 0), (3, 4), (3, 3)], dtype=float)
+    arcs = np.array([(0, 1), (1, 2), (2, 2)])
+    assert_allclose(arc_lengths(P, arcs), [5.0, 1.0, 0.0])
+
+
+def test_angles_between():
+    U = np.array([(1, 1), (1, 0), (0, 1), (1, 0)])
+    V = np.array([(1, 0), (0, 1), (0, 2), (-1, 0)])
+    expected = [angle_between(u, v) for u, v in zip(U, V)]
+    assert_allclose(angles_between(U, V), expected, atol=1e-6)
+
+
+def test_all_star_angles():
+    # star from test_star_angles at node 0, and a leaf at node 1
+    P = np.array([(1,1), (2,1), (1,10), (-3,1)], dtype=float)
+    arcs = np.array([(0, 1), (2, 0), (0, 3)])
+
+    centers, angles = all_star_angles(P, arcs, [1, 0])
+    assert centers.tolist() == [0, 0, 0, 1]
+    assert_allclose(angles, [np.pi/2, np.pi/2, np.pi, 2*np.pi], atol=1e-6)
@@ -1,6 +1,12 @@
+import os
+import sys
+
+import numpy as np
 from numpy.testing import assert_allclose
+import pytest
 
-from geonet.geosteiner import geosteiner
+from geonet.geosteiner import geosteiner, geosteiner_batch, \
+    GeoSteinerCache
 from geonet.network import SteinerTree
 
 def test_geosteiner():
@@ -24,3 +30,89 @@ def test_geosteiner():
     s = '_0'
     assert s in steiner_pos
     assert_allclose(steiner_pos[s], (0.211, 0.211), atol=1e-3)
+
+
+EFST_STUB = '''
+import sys
+sys.stdout.write(sys.stdin.read())
+'''
+
+BB_STUB = '''
+# star from the terminals to their centroid, except for the last one,
+# which is joined to the first one, in the format of bb
+import sys
+pts = [map(float, l.split()) for l in sys.stdin if l.strip()]
+x = sum(p[0] for p in pts) / len(pts)
+y = sum(p[1] for p in pts) / len(pts)
+print ' % fs'
+for i in range(len(pts) - 1):
+    print '%d T %.4f %.4f S' % (i, x, y)
+print '%d T 0 T' % (len(pts) - 1)
+print 'Euclidean SMT'
+'''
+
+@pytest.fixture
+def stubs(tmpdir, monkeypatch):
+    '''stand-ins for efst and bb on the PATH'''
+    for name, script in [('efst', EFST_STUB), ('bb', BB_STUB)]:
+        path = tmpdir.join(name)
+        path.write('#!' + sys.executable + script)
+        path.chmod(0755)
+    monkeypatch.setenv('PATH', str(tmpdir) + os.pathsep + os.environ['PATH'])
+
+def test_geosteiner_batch(stubs):
+    '''pipelines run concurrently, results in submission order'''
+    pos_list = [{'t%d' % i: (i, k*i % 7) for i in range(k)}
+                for k in range(3, 13)]
+    results = geosteiner_batch(pos_list, processes=4)
+
+    assert len(results) == len(pos_list)
+    for pos, (tree, steiner_pos) in zip(pos_list, results):
+        assert sorted(tree.get_terminal_nodes()) == sorted(pos)
+        assert len(tree.get_arcs()) == len(pos)
+        assert steiner_pos.keys() == ['_0']
+        center = np.mean(pos.values(), axis=0)
+        assert_allclose(steiner_pos['_0'], center, atol=1e-3)
+
+    tree, steiner_pos = geosteiner(pos_list[0])
+    assert_allclose(steiner_pos['_0'], results[0][1]['_0'])
+
+def test_cache(stubs, tmpdir, monkeypatch):
+    '''reuse results, also for shifted terminals and from disk'''
+    pos = {'a': (0, 0), 'b': (6, 0), 'c': (0, 9)}
+    shifted = {'x': (10, 20), 'y': (16, 20), 'z': (10, 29)}
+    path = str(tmpdir.join('cache'))
+
+    cache = GeoSteinerCache(maxsize=1, path=path)
+    tree, steiner_pos = geosteiner(pos, cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    stree, ssteiner_pos = geosteiner(shifted, cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert sorted(stree.get_terminal_nodes()) == ['x', 'y', 'z']
+    assert_allclose(ssteiner_pos['_0'], (12, 23), atol=1e-3)
+    assert_allclose(steiner_pos['_0'], (2, 3), atol=1e-3)
+
+    # same point set with other names and order
+    renamed = {'p': (0, 9), 'q': (6, 0), 'r': (0, 0)}
+    rtree, rsteiner_pos = geosteiner(renamed, cache)
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert_allclose(rsteiner_pos['_0'], (2, 3), atol=1e-3)
+    names = dict(zip('abc', 'rqp'))
+    assert sorted(rtree.get_arcs()) == \
+        sorted((names.get(u, u), names.get(v, v)) for u, v in tree.get_arcs())
+
+    # least recently used entry is evicted from memory
+    geosteiner({'a': (0, 0), 'b': (1, 0), 'c': (0, 1)}, cache)
+    assert len(cache) == 1 and cache.misses == 2
+
+    # without GeoSteiner, results come from disk
+    monkeypatch.setenv('PATH', str(tmpdir.join('empty')))
+    cache = GeoSteinerCache(path=path)
+    tree, steiner_pos = geosteiner(pos, cache)
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert_allclose(steiner_pos['_0'], (2, 3), atol=1e-3)
+
+    results = geosteiner_batch([pos, shifted], cache=cache)
+    assert (cache.hits, cache.misses) == (3, 0)
+    assert_allclose(results[1][1]['_0'], (12, 23), atol=1e-3)
@@ -6,7 +6,8 @@ import networkx as nx
 
 from geonet.network import Net, SteinerTree
 from geonet.isomorph import are_isomorphic, enum_Steiner_only, label_fst, \
-    default_steiner_ids, enum
+    default_steiner_ids, enum, iter_enum, iter_enum_orderly, count_fsts, \
+    code_fst, canonical_form
 
 def test_default_steiner_ids():
     '''Check some valid properties of IDs'''
@@ -61,6 +62,17 @@ def test_rename_is_isomorphic():
     for net in graphs:
         assert are_isomorphic(net, uppercase(net))
 
+def test_canonical_form():
+    '''Forms distinguish forests, including trees with two centres.'''
+    forms = [canonical_form(g) for g in graphs]
+    assert len(set(forms)) == len(forms)
+
+    # edge vs. two isolated nodes
+    assert canonical_form(graphs[3]) != canonical_form(graphs[2])
+
+    with pytest.raises(AssertionError):
+        canonical_form(Net('abc', [('a', 'b'), ('b', 'c'), ('c', 'a')]))
+
 # tests for enum_Steiner_only
 
 def test_enum_Steiner_only_small():
@@ -87,6 +99,12 @@ def test_enum_Steiner_only_small():
     for t1, t2 in combinations(reprtree.values(), 2):
         assert not are_isomorphic(t1, t2)
 
+def test_enum_Steiner_only_large():
+    '''Number of trees with maximum degree 3 (A000672 from oeis.org)'''
+    nclasses, _ = enum_Steiner_only(16)
+    assert [nclasses[j] for j in range(1, 15)] == \
+        [1, 1, 1, 2, 2, 4, 6, 11, 18, 37, 66, 135, 265, 552]
+
 # tests for label_fst
 
 def test_label_fst():
@@ -108,6 +126,30 @@ def test_label_fst():
                       '8':O, '9':O})
     assert label_fst(t8) == ((('2', ('3', '4')), (('5', ('8', '9')), ('6', '7'))))
 
+def test_code_fst():
+    '''Integer codes identify the same classes as labels'''
+    O = (0, 0) # dummy location
+
+    # preorder bits: 1 (s), 0 01 (b), 0 10 (c)
+    Y = SteinerTree('abcs', ['as', 'bs', 'cs'], {'a':O, 'b':O, 'c':O})
+    assert code_fst(Y) == 0b1001010
+
+    # relabeling Steiner nodes does not change the code
+    H1 = SteinerTree('abcdst', ['as', 'bs', 'st', 'tc', 'td'],
+                     {'a':O, 'b':O, 'c':O, 'd': O})
+    H2 = SteinerTree('abcdst', ['at', 'bt', 'st', 'sc', 'sd'],
+                     {'a':O, 'b':O, 'c':O, 'd': O})
+    assert code_fst(H1) == code_fst(H2)
+
+    pos = {k:None for k in range(6)}
+    pairs = set((l, code_fst(t)) for l, t in iter_enum_orderly(pos))
+    assert len(pairs) == len(set(l for l, _ in pairs)) == \
+        len(set(c for _, c in pairs)) == count_fsts(6)
+
+    codes = enum(pos, label=code_fst)
+    assert all(isinstance(c, (int, long)) for c in codes)
+    assert sorted(codes) == sorted(c for _, c in pairs)
+
 # tests for enum
 
 def test_enum():
@@ -126,3 +168,38 @@ def test_enum():
         pos = {k:None for k in range(x)}
         trees = enum(pos)
         assert len(trees) == y
+
+
+def test_iter_enum():
+    '''Streaming enumeration yields each class once, lazily.'''
+    pos = {k:None for k in range(5)}
+    gen = iter_enum(pos)
+    label, tree = next(gen)
+    assert isinstance(tree, SteinerTree)
+    assert tree.is_full_steiner_topology()
+
+    labels = [label] + [l for l, _ in gen]
+    assert len(labels) == len(set(labels)) == 15
+    assert set(labels) == set(enum(pos))
+
+
+def test_iter_enum_orderly():
+    '''Orderly generation matches the classes of enum, without duplicates'''
+    for n in range(3, 7):
+        pos = {k:None for k in range(n)}
+        labels = []
+        for label, tree in iter_enum_orderly(pos):
+            assert tree.is_full_steiner_topology()
+            labels.append(label)
+        assert len(labels) == len(set(labels)) == count_fsts(n)
+        assert set(labels) == set(enum(pos))
+
+    # continue from an index
+    pos = {k:None for k in range(6)}
+    labels = [l for l, _ in iter_enum_orderly(pos)]
+    assert [l for l, _ in iter_enum_orderly(pos, start=40)] == labels[40:]
+
+    # feasible beyond the naive permutations
+    pos = {k:None for k in range(7)}
+    labels = set(l for l, _ in iter_enum_orderly(pos))
+    assert len(labels) == count_fsts(7) == 945
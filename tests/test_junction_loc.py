@@ -0,0 +1,84 @@
+import cvxpy as cvx
+import pytest
+from numpy.testing import assert_allclose
+
+from geonet.flow import find_tree_flow
+from geonet.isomorph import iter_enum_orderly
+from geonet.junction_loc import steiner_pos, get_template, SteinerPosTemplate
+
+term_pos = {'a':(0,0), 'b':(0,40), 'c':(30,40), 'd':(30,0), 'e':(15,50)}
+demand = {'a':-40, 'b':10, 'c':10, 'd':10, 'e':10}
+diams = [0.4, 0.6, 0.8, 1., 1.2]
+costs = [680., 910., 1200., 1550., 1960.]
+pres = [40, 80]
+
+@pytest.mark.parametrize("index", [1, 6, 11])
+def test_vectorized(index):
+    '''Vectorized and loop models have the same solution.'''
+    _, tree = list(iter_enum_orderly(term_pos))[index]
+    flow = find_tree_flow(tree, demand)
+
+    pos, obj = steiner_pos(tree, flow, diams, costs, pres, vectorized=False)
+    vpos, vobj = steiner_pos(tree, flow, diams, costs, pres, vectorized=True)
+    assert obj is not None and vobj is not None
+
+    assert vobj == pytest.approx(obj, rel=1e-5)
+    assert set(vpos) == set(pos)
+    for n in pos:
+        assert_allclose(vpos[n], pos[n], atol=1e-2)
+    for t, p in term_pos.items():
+        assert_allclose(vpos[t], p, atol=1e-6)
+
+
+def test_template():
+    '''Shared template solves all trees of one shape.'''
+    trees = [t for _, t in iter_enum_orderly(term_pos)]
+    template = get_template(8, 7, 5, len(diams))
+    assert get_template(8, 7, 5, len(diams)) is template
+
+    for tree in trees[:15:4]:
+        flow = find_tree_flow(tree, demand)
+        pos, obj = steiner_pos(tree, flow, diams, costs, pres)
+        tpos, tobj = steiner_pos(tree, flow, diams, costs, pres, template=True)
+        assert tobj == pytest.approx(obj, rel=1e-5)
+        for n in pos:
+            assert_allclose(tpos[n], pos[n], atol=1e-2)
+
+    with pytest.raises(AssertionError):
+        template.solve(trees[0], find_tree_flow(trees[0], demand),
+                       diams[:-1], costs[:-1], pres)
+
+
+def test_warm_start():
+    '''Repeated SCS solves of a template continue from the last solution.'''
+    _, tree = list(iter_enum_orderly(term_pos))[11]
+    flow = find_tree_flow(tree, demand)
+    _, obj = steiner_pos(tree, flow, diams, costs, pres)
+
+    template = SteinerPosTemplate(8, 7, 5, len(diams))
+    template.solve(tree, flow, diams, costs, pres)
+    iters = []
+    for warm_start in [False, True, True]:
+        template.prob.solve(solver=cvx.SCS, warm_start=warm_start)
+        iters.append(template.prob.solver_stats.num_iters)
+    assert iters[-1] < iters[0] / 10
+
+    # inaccurate SCS solutions are refined, not dropped
+    pos, tobj = template.solve(tree, flow, diams, costs, pres,
+                               solver=cvx.SCS, warm_start=True)
+    assert pos is not None
+    assert tobj == pytest.approx(obj, rel=1e-3)
+
+
+def test_warm_start_sequence(capsys):
+    '''Warm starts over many topologies give a solution for each.'''
+    template = SteinerPosTemplate(8, 7, 5, len(diams))
+    for _, tree in list(iter_enum_orderly(term_pos))[:15]:
+        flow = find_tree_flow(tree, demand)
+        _, obj = steiner_pos(tree, flow, diams, costs, pres)
+        pos, tobj = template.solve(tree, flow, diams, costs, pres,
+                                   solver=cvx.SCS, warm_start=True)
+        assert pos is not None
+        assert tobj == pytest.approx(obj, rel=1e-3)
+    out, _ = capsys.readouterr()
+    assert 'Problem not solved' not in out
@@ -1,9 +1,11 @@
 import numpy as np
+import pytest
 from numpy.testing import assert_allclose
 
-from geonet.flow import find_arc_flow
+from geonet.constants import abstol
+from geonet.flow import find_arc_flow, make_forward_flow
 from geonet.geometry import star_angles
-from geonet.mintrans import steiner_pos
+from geonet.mintrans import steiner_pos, steiner_pos_batch
 from geonet.network import SteinerTree
 
 
@@ -30,3 +32,96 @@ def test_length():
     # all angles are equal (to 120 deg = 2/3 pi)
     angles = star_angles('s', 'abc', pos)
     assert_allclose(angles, [2.0/3.0*np.pi]*3, atol=1e-4)
+
+
+def test_vectorized():
+    '''vectorized and loop models give the same positions'''
+    nodes = 'abcdst'
+    arcs = ['as', 'bs', 'st', 'ct', 'dt']
+    terminals = {'a': (0,0), 'b': (0,2), 'c': (3,2), 'd': (3,0)}
+    tree = SteinerTree(nodes, arcs, terminals)
+
+    flow = find_arc_flow(tree, {'a':-4, 'b':1, 'c':2, 'd':1})
+    tree, flow = make_forward_flow(tree, flow)
+
+    pos = steiner_pos(tree, flow, vectorized=False)
+    vpos = steiner_pos(tree, flow, vectorized=True)
+    assert set(pos) == set(vpos)
+    for n in pos:
+        assert_allclose(vpos[n], pos[n], atol=1e-4)
+
+
+def test_weiszfeld():
+    '''NumPy solver matches cvxpy, also for degenerate and batched trees'''
+    nodes = 'abcdst'
+    arcs = ['as', 'bs', 'st', 'ct', 'dt']
+    terminals = {'a': (0,0), 'b': (0,2), 'c': (3,2), 'd': (3,0)}
+    tree = SteinerTree(nodes, arcs, terminals)
+
+    flow = find_arc_flow(tree, {'a':-4, 'b':1, 'c':2, 'd':1})
+    tree, flow = make_forward_flow(tree, flow)
+
+    for flow_exp in [0.0, 1.0]:
+        pos = steiner_pos(tree, flow, flow_exp=flow_exp)
+        wpos = steiner_pos(tree, flow, flow_exp=flow_exp, method='weiszfeld')
+        assert set(pos) == set(wpos)
+        for n in pos:
+            assert_allclose(wpos[n], pos[n], atol=abstol)
+
+    # high flow from a: s collapses onto terminal a
+    flow = find_arc_flow(tree, {'a':-30, 'b':10, 'c':10, 'd':10})
+    tree, flow = make_forward_flow(tree, flow)
+    pos = steiner_pos(tree, flow)
+    wpos = steiner_pos(tree, flow, method='weiszfeld')
+    assert_allclose(wpos['s'], terminals['a'], atol=abstol)
+    for n in pos:
+        assert_allclose(wpos[n], pos[n], atol=abstol)
+
+    # batch with trees of different shapes
+    star = SteinerTree('abcs', ['as', 'bs', 'cs'],
+                       {'a': (0,0), 'b': (1,0), 'c': (0,1)})
+    star_flow = {a:1.0 for a in star.get_arcs()}
+    trees = [star, tree, star]
+    flows = [star_flow, flow, star_flow]
+    sols = steiner_pos_batch(trees, flows, flow_exp=0.0)
+    for t, f, sol in zip(trees, flows, sols):
+        pos = steiner_pos(t, f, flow_exp=0.0, method='weiszfeld')
+        for n in pos:
+            assert_allclose(sol[n], pos[n], atol=abstol)
+    assert_allclose(sols[0]['s'], (0.211, 0.211), atol=1e-3)
+
+    with pytest.raises(ValueError):
+        steiner_pos(tree, flow, method='simplex')
+
+
+def test_weiszfeld_zero_flow():
+    '''terminals without demand give arcs with zero flow'''
+    nodes = 'abcdefstuv'
+    arcs = ['as', 'bs', 'st', 'ct', 'tu', 'du', 'uv', 'ev', 'fv']
+    terminals = {'a': (0,0), 'b': (0,2), 'c': (3,3), 'd': (5,0),
+                 'e': (8,3), 'f': (8,0)}
+    tree = SteinerTree(nodes, arcs, terminals)
+
+    def cost(pos):
+        return sum(flow[u, v] * np.hypot(*np.subtract(pos[u], pos[v]))
+                   for u, v in tree.get_arcs())
+
+    demands = [{'a':-4, 'b':2, 'c':0, 'd':2, 'e':0, 'f':0},
+               {'a':-4, 'b':0, 'c':2, 'd':0, 'e':0, 'f':2},
+               {'a':-2, 'b':2, 'c':0, 'd':0, 'e':0, 'f':0}]
+    for demand in demands:
+        tree, flow = make_forward_flow(tree, find_arc_flow(tree, demand))
+        pos = steiner_pos(tree, flow, solver='ECOS')
+        wpos = steiner_pos(tree, flow, method='weiszfeld')
+        assert np.isfinite([wpos[n] for n in wpos]).all()
+        assert cost(wpos) == pytest.approx(cost(pos), rel=1e-6, abs=1e-6)
+
+    # without convergence, the cvxpy solution is used
+    sol, = steiner_pos_batch([tree], [flow], maxiter=1)
+    assert cost(sol) == pytest.approx(cost(pos), rel=1e-6, abs=1e-6)
+
+    # no flow at all: any positions are optimal, but must be finite
+    flow = {a:0.0 for a in tree.get_arcs()}
+    wpos = steiner_pos(tree, flow, method='weiszfeld')
+    assert np.isfinite([wpos[n] for n in wpos]).all()
+    assert cost(wpos) == 0.0
@@ -1,6 +1,6 @@
 import pytest
 
-from geonet.network import Net, SteinerTree, merge_pos
+from geonet.network import Net, SteinerTree, CompactTree, merge_pos
 
 def test_Net():
     nodes = ['a', 'b', 'c', 'd']
@@ -124,3 +124,34 @@ def test_equality():
     assert not SteinerTree('abc', ['ab'], {'a':0}) != SteinerTree('abc', ['ab'], {'a':0})
     assert SteinerTree('abc', ['ab'], {'a':0}) != SteinerTree('abc', ['ab'], {})
     assert SteinerTree('abc', ['ab'], {'a':0}) != SteinerTree('abc', ['ab'], {'a':1})
+
+def test_CompactTree():
+    O = (0.0, 0.0)
+    H = SteinerTree('abcdst', ['as', 'bs', 'st', 'ct', 'dt'],
+                    {'a':O, 'b':(1.0, 0.0), 'c':O, 'd':(0.0, 2.0)})
+
+    compact = CompactTree.from_steiner_tree(H)
+    assert compact.arcs.shape == (5, 2)
+    assert compact.pos.shape == (6, 2)
+    assert compact.terminal.sum() == 4
+
+    assert set(compact.get_nodes()) == set(H.get_nodes())
+    assert set(compact.get_arcs()) == set(H.get_arcs())
+    assert set(compact.get_terminal_nodes()) == set('abcd')
+    assert set(compact.get_steiner_nodes()) == set('st')
+    assert compact.get_terminal_positions() == H.get_terminal_positions()
+    for n in H.get_nodes():
+        assert compact.is_terminal(n) == H.is_terminal(n)
+        assert compact.get_degree(n) == H.get_degree(n)
+        assert set(compact.get_neighbors(n)) == set(H.get_neighbors(n))
+    assert compact.get_position('d') == (0.0, 2.0)
+    with pytest.raises(KeyError):
+        compact.get_position('s')
+
+    assert compact.is_full_steiner_topology()
+    assert compact.to_steiner_tree() == H
+    assert compact == CompactTree.from_steiner_tree(compact.to_steiner_tree())
+
+    V = SteinerTree('abc', ['ab', 'bc'], {'a':O, 'b':O, 'c':O})
+    assert not CompactTree.from_steiner_tree(V).is_full_steiner_topology()
+    assert CompactTree.from_steiner_tree(V).to_steiner_tree() == V
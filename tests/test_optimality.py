@@ -0,0 +1,53 @@
+import numpy as np
+
+from geonet.flow import find_arc_flow
+from geonet.mintrans import steiner_pos
+from geonet.network import SteinerTree
+from geonet.optimality import classify, classify_all
+from geonet.optimization import Solution
+
+star = SteinerTree('abcs', ['as', 'bs', 'cs'],
+                   {'a': (0,0), 'b': (1,0), 'c': (0,1)})
+
+def test_classify_star():
+    ones = {a:1.0 for a in star.get_arcs()}
+    pos = steiner_pos(star, ones, flow_exp=0.0)
+    report = classify(star, pos)
+    assert report.optimal
+    assert report.angle_violations == []
+
+    report = classify(star, {'s': (0.3, 0.3)})
+    assert not report.optimal
+    assert report.angle_violations == ['s']
+    assert report.collapsed == report.zero_edges == []
+
+    report = classify(star, {'s': (0, 0)})
+    assert not report.optimal
+    assert report.angle_violations == []
+    assert report.collapsed == [('s', 'a')]
+    assert report.zero_edges == [('a', 's')]
+
+
+def test_classify_all():
+    '''bulk classification agrees with single trees'''
+    terms = {'a': (0,0), 'b':(0,2), 'c':(3,2), 'd':(3,0)}
+    tree = SteinerTree('abcdst', ['as', 'bs', 'st', 'ct', 'dt'], terms)
+    other = SteinerTree('abcdst', ['as', 'ds', 'st', 'ct', 'bt'], terms)
+    ones = {a:1.0 for a in tree.get_arcs()}
+    opt = steiner_pos(tree, ones, flow_exp=0.0)
+
+    sols = [Solution(tree, opt, None),
+            Solution(star, {'s': (0, 0)}, None),
+            Solution(other, {'s': (0, 2), 't': (3, 2)}, None),
+            Solution(star, {'s': (0.3, 0.3)}, None),
+            Solution(tree, {'s': (1, 1), 't': (1, 1)}, None)]
+    reports = classify_all(sols)
+    assert reports == [classify(s.tree, s.steiner_pos) for s in sols]
+    assert [r.optimal for r in reports] == [True, False, False, False, False]
+
+    # s is on terminal b, but not adjacent
+    assert reports[2].collapsed == [('s', 'b'), ('t', 'c')]
+    assert reports[2].zero_edges == [('c', 't')]
+    assert reports[4].zero_edges == [('s', 't')]
+
+    assert classify_all([]) == []
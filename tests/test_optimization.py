@@ -1,7 +1,9 @@
 import pytest
 
 from geonet.network import SteinerTree
-from geonet.optimization import Instance, Solution, enum_fsts
+import geonet.optimization
+from geonet.optimization import Instance, Solution, enum_fsts, lower_bound, \
+    resume_fsts
 
 def test_enum_fst():
     '''Call and check the structure of result (but not content).'''
@@ -31,3 +33,121 @@ def test_enum_fst():
     pos = sol.steiner_pos[st]
     assert pos[0] >= 0 and pos[0] <= 10
     assert pos[1] >= 0 and pos[1] <= 10
+
+def test_enum_fst_workers():
+    '''Parallel evaluation gives the same solutions.'''
+    term_pos = {'a':(0,0), 'b':(10,0), 'c':(0,10), 'd':(10,10)}
+    demand = {'a':-30, 'b':10, 'c':10, 'd':10}
+    diams = [0.4, 0.6, 0.8, 1., 1.2]
+    costs = [680., 910., 1200., 1550., 1960.]
+    inst = Instance(term_pos, demand, diams, costs, 40, 80, 1.0)
+
+    serial = enum_fsts(inst)
+    parallel = enum_fsts(inst, workers=2, chunksize=2)
+    template = enum_fsts(inst, workers=2, template=True)
+    assert len(serial) == len(parallel) == len(template) == 3
+
+    for s, p, t in zip(serial, parallel, template):
+        assert isinstance(p.tree, SteinerTree)
+        assert p.tree == s.tree
+        assert p.obj == pytest.approx(s.obj)
+        assert t.obj == pytest.approx(s.obj, rel=1e-5)
+
+def test_enum_fst_prune():
+    '''Pruning keeps the best solution and reports skipped topologies.'''
+    # low demand: smallest diameter is almost sufficient
+    term_pos = {'a':(0,0), 'b':(0,40), 'c':(10,40), 'd':(10,0)}
+    demand = {'a':-3, 'b':1, 'c':1, 'd':1}
+    diams = [0.4, 0.6, 0.8, 1., 1.2]
+    costs = [680., 910., 1200., 1550., 1960.]
+    inst = Instance(term_pos, demand, diams, costs, 10, 100, 1.0)
+
+    full = enum_fsts(inst)
+    for sol in full:
+        assert lower_bound(inst, sol.tree, 'terminal') <= sol.obj
+        assert lower_bound(inst, sol.tree, 'length') <= sol.obj
+
+    for method in ['terminal', 'length']:
+        stats = {}
+        sols = enum_fsts(inst, prune=method, stats=stats)
+        assert stats['topologies'] == 3
+        assert stats['pruned'] == 2
+        assert len(sols) == 1
+        assert sols[0].obj == pytest.approx(full[0].obj)
+
+    with pytest.raises(ValueError):
+        lower_bound(inst, full[0].tree, 'foo')
+
+def test_enum_fst_top_k():
+    '''Only the best solutions are kept.'''
+    term_pos = {'a':(0,0), 'b':(0,40), 'c':(30,40), 'd':(30,0), 'e':(15,50)}
+    demand = {'a':-4, 'b':1, 'c':1, 'd':1, 'e':1}
+    diams = [0.4, 0.6, 0.8, 1., 1.2]
+    costs = [680., 910., 1200., 1550., 1960.]
+    inst = Instance(term_pos, demand, diams, costs, 10, 100, 1.0)
+
+    full = enum_fsts(inst)
+    assert len(full) == 15
+
+    for k in [1, 4]:
+        sols = enum_fsts(inst, top_k=k)
+        assert len(sols) == k
+        for s, f in zip(sols, full):
+            assert s.obj == pytest.approx(f.obj)
+
+        sols = enum_fsts(inst, top_k=k, prune='length')
+        assert len(sols) == k
+        for s, f in zip(sols, full):
+            assert s.obj == pytest.approx(f.obj)
+
+    stats = {}
+    enum_fsts(inst, top_k=1, prune='length', stats=stats)
+    assert stats['pruned'] > 0
+
+    # workers see the incumbent too, with at most 2 topologies in flight
+    pstats = {}
+    sols = enum_fsts(inst, workers=2, top_k=1, prune='length', stats=pstats)
+    assert sols[0].obj == pytest.approx(full[0].obj)
+    assert pstats['pruned'] >= stats['pruned'] - 2
+    assert pstats['pruned'] > 0
+
+
+def test_checkpoint_resume(tmpdir, monkeypatch):
+    '''Interrupted enumeration continues without solving topologies again.'''
+    term_pos = {'a':(0,0), 'b':(0,40), 'c':(30,40), 'd':(30,0), 'e':(15,50)}
+    demand = {'a':-4, 'b':1, 'c':1, 'd':1, 'e':1}
+    diams = [0.4, 0.6, 0.8, 1., 1.2]
+    costs = [680., 910., 1200., 1550., 1960.]
+    inst = Instance(term_pos, demand, diams, costs, 10, 100, 1.0)
+    path = str(tmpdir.join('enum.ckpt'))
+
+    full = enum_fsts(inst)
+
+    solve_topology = geonet.optimization.solve_topology
+    calls = []
+    kill = [True]
+    def interrupted(instance, tree, **options):
+        if kill[0] and len(calls) == 7:
+            raise RuntimeError('killed')
+        calls.append(tree)
+        return solve_topology(instance, tree, **options)
+    monkeypatch.setattr(geonet.optimization, 'solve_topology', interrupted)
+    with pytest.raises(RuntimeError):
+        enum_fsts(inst, checkpoint=path, checkpoint_every=3)
+
+    # saved after 6 solved topologies, 7th is lost
+    kill[0] = False
+    del calls[:]
+    stats = {}
+    sols = resume_fsts(path, stats=stats)
+    assert len(calls) == 15 - 6
+    assert stats == {'topologies': 15, 'pruned': 0}
+    assert len(sols) == len(full)
+    for s, f in zip(sols, full):
+        assert isinstance(s.tree, SteinerTree)
+        assert s.obj == pytest.approx(f.obj)
+
+    # nothing left to do
+    del calls[:]
+    assert len(resume_fsts(path)) == len(full)
+    assert calls == []